@@ -1,7 +1,392 @@
+import os
+import re
+import sys
+import mmap
+import time
+import heapq
+import struct
+import bisect
+import hashlib
+import argparse
+from array import array
+from functools import partial
+from collections import Counter, defaultdict
+
+HEADER = struct.Struct("<QQ")
+TOKEN = re.compile(r"\w+")
+INDEX_MAGIC = b"DSIDX001"
+# magic, bytes and sentences indexed, the corpus modification time, the
+# vocabulary's length in bytes, terms, postings, followers, and a hash of
+# the indexed bytes
+INDEX_HEADER = struct.Struct("<8sQQQQQQQ20s")
+# prefixes this short match so many terms that their completions are cached
+CACHED_PREFIX = 2
+
+
+class SentenceCorpus:
+    """
+    A corpus with one sentence per line, such as the Leipzig corpora
+    ("<id>\\t<sentence>"), mapped into memory instead of read. The byte
+    offset of every line is kept in an array, and saved next to the corpus
+    as <corpus>.offsets so that opening it again doesn't rescan the file.
+    Lines are only decoded when they are asked for.
+    """
+
+    def __init__(self, path: str, persist: bool = True):
+        self.path = path
+        self.file = open(path, "rb")
+        stat = os.fstat(self.file.fileno())
+        self.key = (stat.st_size, stat.st_mtime_ns)
+        # mmap refuses empty files
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size > 0 else b""
+        self.offsets = self._load_offsets()
+        if self.offsets is None:
+            self.offsets = self._scan()
+            if persist:
+                self._save_offsets()
+
+    def _typecode(self):
+        return "I" if self.key[0] < 2 ** 32 else "Q"
+
+    def _scan(self):
+        offsets = array(self._typecode(), [0])
+        find = self.map.find
+        size = len(self.map)
+        position = find(b"\n")
+        while position >= 0:
+            offsets.append(position + 1)
+            position = find(b"\n", position + 1)
+        # a last line without a newline still counts
+        if offsets[-1] < size:
+            offsets.append(size)
+        return offsets
+
+    def _load_offsets(self):
+        try:
+            with open(self.path + ".offsets", "rb") as f:
+                if HEADER.unpack(f.read(HEADER.size)) != self.key:
+                    return None
+                offsets = array(self._typecode())
+                offsets.frombytes(f.read())
+                return offsets
+        except (OSError, struct.error, ValueError):
+            return None
+
+    def _save_offsets(self):
+        temporary = self.path + ".offsets.tmp"
+        try:
+            with open(temporary, "wb") as f:
+                f.write(HEADER.pack(*self.key))
+                self.offsets.tofile(f)
+            os.replace(temporary, self.path + ".offsets")
+        except OSError:
+            # a read-only corpus folder just means scanning it every time
+            pass
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def line_bytes(self, index: int):
+        start = self.offsets[index]
+        end = self.offsets[index + 1]
+        return self.map[start:end].rstrip(b"\r\n")
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("sentence index out of range")
+        return self.line_bytes(index).decode("utf8")
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.line_bytes(index).decode("utf8")
+
+    def sentence(self, index: int):
+        """
+        The sentence on a line, without the Leipzig id column if it has one.
+        """
+        line = self[index]
+        number, tab, text = line.partition("\t")
+        return text if tab and number.isdigit() else line
+
+    def close(self):
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def tokenize(text: str):
+    return TOKEN.findall(text.lower())
+
+
+def contains(sorted_ids, value: int):
+    i = bisect.bisect_left(sorted_ids, value)
+    return i < len(sorted_ids) and sorted_ids[i] == value
+
+
+def padded(length: int):
+    return length + -length % 8
+
+
+class SentenceIndex:
+    """
+    An inverted index over a SentenceCorpus, kept in <corpus>.index. Terms
+    are numbered in sorted order, so the terms starting with a prefix are a
+    contiguous range of ids. For every term the file holds the sorted ids
+    of the sentences containing it, and the ids and counts of the terms
+    that follow it, from which phrase completions are ranked. The file is
+    mapped rather than read, so opening even a large index is cheap.
+    """
+
+    def __init__(self, corpus: SentenceCorpus, path: str = None):
+        self.corpus = corpus
+        self.path = path if path is not None else corpus.path + ".index"
+        self.map = None
+        self.cache = {}
+
+    @classmethod
+    def open(cls, corpus: SentenceCorpus, path: str = None, rebuild: bool = False, verbose: bool = False):
+        """
+        Opens the index of corpus, building it if there is none or the
+        corpus has changed. If lines were only appended to the corpus, just
+        those are tokenized and merged into the existing index.
+        """
+        index = cls(corpus, path)
+        state = None if rebuild else index._load()
+        if state == "current":
+            return index
+        start = time.perf_counter()
+        if state == "appended":
+            postings, followers = index._thaw()
+            first = index.sentences
+            index.close()
+        else:
+            postings, followers, first = defaultdict(partial(array, "I")), Counter(), 0
+        index._add(postings, followers, first)
+        index._save(postings, followers)
+        index._load()
+        if verbose:
+            action = "extended" if state == "appended" else "built"
+            print(f"{action} index of {len(corpus) - first} sentences in {time.perf_counter() - start:.2f} s")
+        return index
+
+    def _prefix_hash(self, end: int):
+        with memoryview(self.corpus.map) as view, view[:end] as prefix:
+            return hashlib.sha1(prefix).digest()
+
+    def _load(self):
+        try:
+            with open(self.path, "rb") as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        if len(self.map) < INDEX_HEADER.size:
+            self.close()
+            return None
+        (magic, indexed, modified, sentences, vocabulary, terms, postings,
+         followers, digest) = INDEX_HEADER.unpack_from(self.map)
+        offsets = self.corpus.offsets
+        if magic != INDEX_MAGIC or sentences > len(self.corpus) or offsets[sentences] != indexed:
+            self.close()
+            return None
+        # a corpus that was touched or appended to still starts with exactly
+        # the bytes that were indexed
+        if (indexed, modified) != self.corpus.key and self._prefix_hash(indexed) != digest:
+            self.close()
+            return None
+        self.sentences = sentences
+        view = memoryview(self.map)
+        position = INDEX_HEADER.size
+
+        def section(length, format=None):
+            nonlocal position
+            part = view[position:position + length]
+            position += padded(length)
+            return part if format is None else part.cast(format)
+
+        self.terms = str(section(vocabulary), "utf8").split("\n") if terms > 0 else []
+        self.ids = {term: i for i, term in enumerate(self.terms)}
+        self.posting_offsets = section((terms + 1) * 8, "Q")
+        self.postings = section(postings * 4, "I")
+        self.follower_offsets = section((terms + 1) * 8, "Q")
+        self.followers = section(followers * 4, "I")
+        self.follower_counts = section(followers * 4, "I")
+        self.cache = {}
+        return "current" if sentences == len(self.corpus) else "appended"
+
+    def _thaw(self):
+        postings = defaultdict(partial(array, "I"))
+        followers = Counter()
+        for i, term in enumerate(self.terms):
+            postings[term] = array("I", self.postings[self.posting_offsets[i]:self.posting_offsets[i + 1]])
+            start, end = self.follower_offsets[i], self.follower_offsets[i + 1]
+            for follower, count in zip(self.followers[start:end], self.follower_counts[start:end]):
+                followers[term, self.terms[follower]] = count
+        return postings, followers
+
+    def _add(self, postings, followers, first: int):
+        sentence = self.corpus.sentence
+        for i in range(first, len(self.corpus)):
+            tokens = tokenize(sentence(i))
+            for term in set(tokens):
+                postings[term].append(i)
+            followers.update(zip(tokens, tokens[1:]))
+
+    def _save(self, postings, followers):
+        terms = sorted(postings)
+        ids = {term: i for i, term in enumerate(terms)}
+        posting_offsets = array("Q", [0])
+        all_postings = array("I")
+        for term in terms:
+            all_postings.extend(postings[term])
+            posting_offsets.append(len(all_postings))
+        # packed as follower id and count, so that each group sorts by follower
+        grouped = [[] for _ in terms]
+        for (term, follower), count in followers.items():
+            grouped[ids[term]].append(ids[follower] << 32 | count)
+        follower_offsets = array("Q", [0])
+        all_followers = array("I")
+        all_counts = array("I")
+        for group in grouped:
+            group.sort()
+            all_followers.extend([pair >> 32 for pair in group])
+            all_counts.extend([pair & 0xffffffff for pair in group])
+            follower_offsets.append(len(all_followers))
+        vocabulary = "\n".join(terms).encode("utf8")
+        sentences = len(self.corpus)
+        indexed = self.corpus.offsets[sentences]
+        header = INDEX_HEADER.pack(INDEX_MAGIC, indexed, self.corpus.key[1], sentences, len(vocabulary), len(terms),
+                                   len(all_postings), len(all_followers), self._prefix_hash(indexed))
+        temporary = self.path + ".tmp"
+        with open(temporary, "wb") as f:
+            f.write(header)
+            for part in [vocabulary, posting_offsets, all_postings, follower_offsets, all_followers, all_counts]:
+                data = bytes(part) if isinstance(part, bytes) else part.tobytes()
+                f.write(data + bytes(padded(len(data)) - len(data)))
+        os.replace(temporary, self.path)
+
+    def frequency(self, term_id: int):
+        return self.posting_offsets[term_id + 1] - self.posting_offsets[term_id]
+
+    def prefix_range(self, prefix: str):
+        return (bisect.bisect_left(self.terms, prefix),
+                bisect.bisect_left(self.terms, prefix + chr(0x10ffff)))
+
+    def containing(self, *terms):
+        """
+        The sorted ids of the sentences containing every one of terms, as a
+        list, so that the index can be closed while a caller still holds it.
+        """
+        lists = []
+        for term in terms:
+            i = self.ids.get(term.lower())
+            if i is None:
+                return []
+            lists.append(self.postings[self.posting_offsets[i]:self.posting_offsets[i + 1]])
+        if len(lists) <= 1:
+            return lists[0].tolist() if len(lists) == 1 else []
+        lists.sort(key=len)
+        result = lists[0].tolist()
+        for other in lists[1:]:
+            result = [i for i in result if contains(other, i)]
+        return result
+
+    def complete_term(self, prefix: str, k: int = 10):
+        """
+        The k most frequent terms starting with prefix.
+        """
+        prefix = prefix.lower()
+        key = (prefix, k)
+        if key in self.cache:
+            return self.cache[key]
+        lo, hi = self.prefix_range(prefix)
+        best = heapq.nlargest(k, range(lo, hi), key=self.frequency)
+        completions = [self.terms[i] for i in best]
+        if len(prefix) <= CACHED_PREFIX:
+            self.cache[key] = completions
+        return completions
+
+    def complete(self, text: str, k: int = 10):
+        """
+        Completes the last word of text, which may be empty if text ends in
+        a space, preferring terms that follow the word before it in the
+        corpus and falling back on the most frequent terms overall.
+        """
+        tokens = tokenize(text)
+        if len(text) == 0 or not text[-1].isalnum():
+            tokens.append("")
+        prefix = tokens[-1]
+        previous = self.ids.get(tokens[-2]) if len(tokens) > 1 else None
+        completions = []
+        if previous is not None:
+            start, end = self.follower_offsets[previous], self.follower_offsets[previous + 1]
+            followers = self.followers[start:end]
+            lo, hi = self.prefix_range(prefix)
+            first, last = start + bisect.bisect_left(followers, lo), start + bisect.bisect_left(followers, hi)
+            best = heapq.nlargest(k, range(first, last), key=self.follower_counts.__getitem__)
+            completions = [self.terms[self.followers[i]] for i in best]
+        if len(completions) < k:
+            seen = set(completions)
+            completions += [term for term in self.complete_term(prefix, k + len(completions))
+                            if term not in seen][:k - len(completions)]
+        return completions
+
+    def close(self):
+        if self.map is not None:
+            # views of the map have to be released before it can be closed
+            self.terms = self.ids = None
+            self.posting_offsets = self.postings = None
+            self.follower_offsets = self.followers = self.follower_counts = None
+            self.map.close()
+            self.map = None
+
+
 def parse_text(file_path):
-    with open(file_path, encoding='utf8',mode='r+') as f:
-        lines = f.readlines()
-        print(len(lines))
-        print(lines[1][1])
+    with SentenceCorpus(file_path) as corpus:
+        print(len(corpus))
+        print(corpus[1][1])
+
+
+def microseconds(query, repeat: int = 1000):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = query()
+    return result, (time.perf_counter() - start) / repeat * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index and query a sentence corpus")
+    parser.add_argument("corpus", nargs="?", default="eng_news-typical_2016_10K-sentences.txt")
+    parser.add_argument("--complete", help="text to complete the last word of")
+    parser.add_argument("--containing", nargs="+", help="find the sentences containing all of these terms")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--rebuild", action="store_true", help="rebuild the index even if it is current")
+    args = parser.parse_args()
+
+    if args.complete is None and args.containing is None:
+        parse_text(args.corpus)
+        sys.exit()
 
-parse_text("eng_news-typical_2016_10K-sentences.txt")
\ No newline at end of file
+    start = time.perf_counter()
+    corpus = SentenceCorpus(args.corpus)
+    print(f"{len(corpus)} sentences loaded in {time.perf_counter() - start:.3f} s")
+    start = time.perf_counter()
+    index = SentenceIndex.open(corpus, rebuild=args.rebuild, verbose=True)
+    print(f"index of {len(index.terms)} terms ready in {time.perf_counter() - start:.3f} s")
+    if args.complete is not None:
+        completions, elapsed = microseconds(lambda: index.complete(args.complete, args.k))
+        print(f"{elapsed:.1f} us: {completions}")
+    if args.containing is not None:
+        ids, elapsed = microseconds(lambda: index.containing(*args.containing))
+        print(f"{elapsed:.1f} us: {len(ids)} sentences")
+        for i in ids[:args.k]:
+            print(f"  {corpus.sentence(i)}")
@@ -18,18 +18,37 @@ This will generate a movie data set of 1100 records.
 These are the first 1100 movies which appear when querying the Freebase of type '/film/film'.
 Here is the link to the freebase page - https://www.freebase.com/film/film?schema=
 
-Usage - python3 film_data_generator.py
+The records are written to films.csv, films.json (or films.jsonl) and films.xml in a
+single pass, each through a streaming writer, so memory use does not grow with the
+number of records. --synthetic N writes N generated records instead of querying, and
+--benchmark measures the writers' throughput on generated records.
+
+--dash N instead generates N documents shaped like those in Dash's own solr core, seeded
+and deterministic, in shards across processes, written as Solr JSON updates and/or posted
+to --solr; --replay Q then sends Q Dash-like queries to that core and reports latencies.
+
+Usage - python3 film_data_generator.py [--jsonl] [--synthetic N] [--benchmark 1000 100000 1000000]
+        python3 film_data_generator.py --serve 8765 (a local stand-in for --service-url http://localhost:8765/mqlread)
+        python3 film_data_generator.py --dash 1000000 [--solr http://localhost:8983/solr/dash] [--replay 10000]
 """
 
+import os
 import csv
-import copy
+import sys
 import json
-import codecs
+import time
+import queue
+import uuid
+import random
+import argparse
 import datetime
+import http.client
+import http.server
 import urllib.parse
+import urllib.error
 import urllib.request
-import xml.etree.cElementTree as ET
-from xml.dom import minidom
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from xml.sax.saxutils import XMLGenerator
 
 MAX_ITERATIONS=10  #10 limits it to 1100 docs
 
@@ -46,72 +65,509 @@ query = [{
   "initial_release_date>" : "2000"
 }]
 
+CSV_KEYS = ['name', 'directed_by', 'genre', 'type', 'id', 'initial_release_date']
+
+class CsvWriter:
+  def __init__(self, path):
+    self.file = open(path, 'w', newline='', encoding='utf8')
+    self.writer = csv.DictWriter(self.file, CSV_KEYS)
+    self.writer.writeheader()
+
+  def write(self, film):
+    #Convert multi-valued to | delimited string
+    self.writer.writerow({key: '|'.join(value) if isinstance(value, list) else value
+                          for key, value in film.items()})
+
+  def close(self):
+    self.file.close()
+
+class JsonWriter:
+  """
+  Writes films as a JSON array laid out like json.dumps(films, indent=2), or with
+  lines=True as JSON lines, one film per line.
+  """
+  def __init__(self, path, lines=False):
+    self.file = open(path, 'w', encoding='utf8')
+    self.lines = lines
+    self.count = 0
+    if not lines:
+      self.file.write('[')
+
+  def write(self, film):
+    if self.lines:
+      self.file.write(json.dumps(film) + '\n')
+    else:
+      self.file.write((',\n  ' if self.count > 0 else '\n  ') + json.dumps(film, indent=2).replace('\n', '\n  '))
+    self.count += 1
+
+  def close(self):
+    if not self.lines:
+      self.file.write('\n]\n' if self.count > 0 else ']\n')
+    self.file.close()
+
+class XmlWriter:
+  """
+  Writes films as a Solr <add> document, one <doc> at a time.
+  """
+  def __init__(self, path):
+    self.file = open(path, 'w', encoding='utf8')
+    self.xml = XMLGenerator(self.file, 'utf-8', short_empty_elements=True)
+    self.xml.startDocument()
+    self.xml.startElement('add', {})
+
+  def field(self, key, value):
+    self.xml.ignorableWhitespace('\n    ')
+    self.xml.startElement('field', {'name': key})
+    self.xml.characters(value)
+    self.xml.endElement('field')
+
+  def write(self, film):
+    self.xml.ignorableWhitespace('\n  ')
+    self.xml.startElement('doc', {})
+    for key, value in film.items():
+      for item in (value if isinstance(value, list) else [value]):
+        self.field(key, item)
+    self.xml.ignorableWhitespace('\n  ')
+    self.xml.endElement('doc')
+
+  def close(self):
+    self.xml.ignorableWhitespace('\n')
+    self.xml.endElement('add')
+    self.xml.ignorableWhitespace('\n')
+    self.xml.endDocument()
+    self.file.close()
+
+def open_writers(folder='.', jsonl=False):
+  return [
+    CsvWriter(os.path.join(folder, 'films.csv')),
+    JsonWriter(os.path.join(folder, 'films.jsonl' if jsonl else 'films.json'), jsonl),
+    XmlWriter(os.path.join(folder, 'films.xml'))
+  ]
+
+def write_films(films, writers):
+  """
+  Writes every film from the iterable films to all of writers in one pass, and
+  returns how many there were.
+  """
+  count = 0
+  try:
+    for film in films:
+      for writer in writers:
+        writer.write(film)
+      count += 1
+  finally:
+    for writer in writers:
+      writer.close()
+  return count
+
 def gen_csv(filmlist):
-  filmlistDup = copy.deepcopy(filmlist)
-  #Convert multi-valued to % delimited string
-  for film in filmlistDup:
-      for key in film:
-        if isinstance(film[key], list):
-          film[key] = '|'.join(film[key])
-  keys = ['name', 'directed_by', 'genre', 'type', 'id', 'initial_release_date']
-  with open('films.csv', 'w', newline='', encoding='utf8') as csvfile:
-    dict_writer = csv.DictWriter(csvfile, keys)
-    dict_writer.writeheader()
-    dict_writer.writerows(filmlistDup)
+  write_films(filmlist, [CsvWriter('films.csv')])
 
 def gen_json(filmlist):
-  filmlistDup = copy.deepcopy(filmlist)
-  with open('films.json', 'w') as jsonfile:
-    jsonfile.write(json.dumps(filmlist, indent=2))
+  write_films(filmlist, [JsonWriter('films.json')])
 
 def gen_xml(filmlist):
-  root = ET.Element("add")
-  for film in filmlist:
-    doc = ET.SubElement(root, "doc")
-    for key in film:
-      if isinstance(film[key], list):
-        for value in film[key]:
-          field = ET.SubElement(doc, "field")
-          field.set("name", key)
-          field.text=value
-      else:
-        field = ET.SubElement(doc, "field")
-        field.set("name", key)
-        field.text=film[key]
-  tree = ET.ElementTree(root)
-  with open('films.xml', 'w') as f:
-    f.write( minidom.parseString(ET.tostring(tree.getroot(),'utf-8')).toprettyxml(indent="  ") )
-
-def do_query(filmlist, cursor=""):
-  params = {
+  write_films(filmlist, [XmlWriter('films.xml')])
+
+GENRES = ['Drama', 'Comedy', 'Thriller', 'Documentary film', 'Action Film', 'Romance Film',
+          'Crime Fiction', 'Horror', 'Animation', 'Science Fiction', 'Indie film', 'Musical']
+SYLLABLES = ['ka', 'lo', 'mi', 'ren', 'sa', 'tor', 'vel', 'an', 'dre', 'o', 'bel', 'ti']
+
+def synthetic_films(count, seed=0):
+  """
+  Yields count made-up films shaped like the Freebase records.
+  """
+  rng = random.Random(seed)
+  def words(n):
+    return ' '.join(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 3))).title() for _ in range(n))
+  for i in range(count):
+    film = {
+      "id": "/en/synthetic_%d" % i,
+      "directed_by": [words(2) for _ in range(rng.randint(1, 2))],
+      "genre": rng.sample(GENRES, rng.randint(1, 5)),
+      "name": words(rng.randint(1, 4))
+    }
+    if rng.random() < 0.9:
+      film["initial_release_date"] = "%d-%02d-%02d" % (rng.randint(2000, 2015), rng.randint(1, 12), rng.randint(1, 28))
+    yield film
+
+def peak_memory_mb():
+  try:
+    import resource
+  except ImportError:
+    return None
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def benchmark(sizes, folder, jsonl=False):
+  for size in sizes:
+    start = time.perf_counter()
+    count = write_films(synthetic_films(size), open_writers(folder, jsonl))
+    elapsed = time.perf_counter() - start
+    written = sum(os.path.getsize(os.path.join(folder, name)) for name in
+                  ['films.csv', 'films.jsonl' if jsonl else 'films.json', 'films.xml'])
+    memory = peak_memory_mb()
+    print("%9d records  %8.2f s  %9.0f records/s  %8.1f MB/s written" %
+          (count, elapsed, count / elapsed, written / elapsed / 2 ** 20) +
+          ("  %7.1f MB peak rss" % memory if memory is not None else ""))
+
+class PagingClient:
+  """
+  Sends GET requests to one host over a small pool of keep-alive connections,
+  retrying failed requests and 429/5xx responses with exponential backoff.
+  """
+  def __init__(self, base_url, retries=4, backoff=0.5, timeout=30, pool_size=2):
+    parts = urllib.parse.urlsplit(base_url)
+    self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    self.host = parts.netloc
+    self.path = parts.path or '/'
+    self.retries = retries
+    self.backoff = backoff
+    self.timeout = timeout
+    self.idle = queue.LifoQueue(pool_size)
+    self.requests = 0
+    self.connections = 0
+
+  def _connection(self):
+    try:
+      return self.idle.get_nowait()
+    except queue.Empty:
+      self.connections += 1
+      return self.connection_class(self.host, timeout=self.timeout)
+
+  def _release(self, connection):
+    try:
+      self.idle.put_nowait(connection)
+    except queue.Full:
+      connection.close()
+
+  def get_json(self, params):
+    target = self.path + '?' + urllib.parse.urlencode(params)
+    for attempt in range(self.retries + 1):
+      connection = self._connection()
+      try:
+        connection.request('GET', target, headers={'Connection': 'keep-alive'})
+        response = connection.getresponse()
+        body = response.read()
+        self.requests += 1
+        if response.status == 429 or response.status >= 500:
+          raise http.client.HTTPException('HTTP %d' % response.status)
+        if response.status != 200:
+          raise urllib.error.HTTPError(target, response.status, response.reason, response.headers, None)
+        if response.will_close:
+          connection.close()
+        else:
+          self._release(connection)
+        return json.loads(body.decode('utf-8'))
+      except (OSError, http.client.HTTPException) as error:
+        connection.close()
+        if isinstance(error, urllib.error.HTTPError) or attempt == self.retries:
+          raise
+        time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+  def close(self):
+    while not self.idle.empty():
+      self.idle.get_nowait().close()
+
+def query_params(cursor):
+  return {
           'query': json.dumps(query),
           'key': API_KEY,
           'cursor': cursor
   }
-  url = service_url + '?' + urllib.parse.urlencode(params)
-  data = urllib.request.urlopen(url).read().decode('utf-8')
-  response = json.loads(data)
+
+def clean_film(item):
+  del item['type'] # It's always /film/film. No point of adding this.
+  try:
+    datetime.datetime.strptime(item['initial_release_date'], "%Y-%m-%d")
+  except (KeyError, TypeError, ValueError):
+    #Date time not formatted properly. Keeping it simple by removing the date field from that doc
+    item.pop('initial_release_date', None)
+  return item
+
+def query_pages(client, max_pages=MAX_ITERATIONS + 1, cursor=""):
+  """
+  Yields the responses for successive cursor pages. As soon as a page has been
+  decoded and its cursor is known, the next page is requested in the background,
+  so it downloads while the caller works through the current one.
+  """
+  with ThreadPoolExecutor(max_workers=1) as fetcher:
+    pending = fetcher.submit(client.get_json, query_params(cursor))
+    for page in range(max_pages):
+      response = pending.result()
+      cursor = response.get("cursor")
+      if cursor and page + 1 < max_pages:
+        pending = fetcher.submit(client.get_json, query_params(cursor))
+      yield response
+      if not cursor:
+        return
+
+def query_films(client=None, max_pages=MAX_ITERATIONS + 1):
+  """
+  Streams the films of up to max_pages pages of the query, cleaned, one at a time.
+  """
+  client = client or PagingClient(service_url)
+  try:
+    for response in query_pages(client, max_pages):
+      for item in response['result']:
+        yield clean_film(item)
+  finally:
+    client.close()
+
+def do_query(filmlist, cursor="", client=None):
+  own = client is None
+  client = client or PagingClient(service_url)
+  try:
+    response = client.get_json(query_params(cursor))
+  finally:
+    if own:
+      client.close()
   for item in response['result']:
-    del item['type'] # It's always /film/film. No point of adding this.
-    try:
-      datetime.datetime.strptime(item['initial_release_date'], "%Y-%m-%d")
-    except ValueError:
-      #Date time not formatted properly. Keeping it simple by removing the date field from that doc
-      del item['initial_release_date']
-    filmlist.append(item)
+    filmlist.append(clean_film(item))
   return response.get("cursor")
 
+def serve_stand_in(port, path='films.json', page_size=100, delay=0.0):
+  """
+  Serves the records of path with Freebase mqlread's cursor protocol on
+  http://localhost:<port>/mqlread, so the paging client can be tried offline.
+  """
+  with open(path, encoding='utf8') as f:
+    films = json.load(f)
+
+  class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # send headers and body together, or Nagle's algorithm stalls kept-alive requests
+    wbufsize = 64 * 1024
+
+    def do_GET(self):
+      params = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+      start = int((params.get('cursor') or ['0'])[0] or 0)
+      page = [dict(film, type='/film/film') for film in films[start:start + page_size]]
+      end = start + page_size
+      body = json.dumps({'result': page, 'cursor': str(end) if end < len(films) else False}).encode('utf-8')
+      time.sleep(delay)
+      self.send_response(200)
+      self.send_header('Content-Type', 'application/json')
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def log_message(self, *args):
+      pass
+
+  server = http.server.ThreadingHTTPServer(('localhost', port), Handler)
+  print("serving %d films at http://localhost:%d/mqlread" % (len(films), port))
+  server.serve_forever()
+
+
+# The dash core's dynamic fields: *_t text, *_n numbers, *_b flags, *_d dates,
+# *_i ids and *_l lists of ids, as written by Dash's server (see ToSearchTerm)
+DASH_NAMESPACE = uuid.UUID('6f1c2b40-4c1e-4d0e-9a51-0d2f3c8a5e11')
+DASH_WORDS = ("interface prototype sketch gesture pen touch stylus canvas layout collection note "
+              "image video audio pdf web research paper design study user study interaction "
+              "visual browser workspace document link annotation tablet mobile keyboard").split()
+DASH_AUTHORS = ['Bill Buxton', 'Andy van Dam', 'Bob Zeleznik', 'Mary Ann', 'Sam Wilkins', 'Tyler Schicke']
+DASH_TYPES = [('rtf', 0.45), ('image', 0.25), ('collection', 0.15), ('pdf', 0.1), ('web', 0.05)]
+DASH_PROTOTYPES = 100
+DASH_EPOCH = datetime.datetime(2018, 1, 1, tzinfo=datetime.timezone.utc).timestamp()
+
+def dash_id(seed, index):
+  return str(uuid.uuid5(DASH_NAMESPACE, "%d/%d" % (seed, index)))
+
+def dash_date(seconds):
+  return datetime.datetime.fromtimestamp(DASH_EPOCH + seconds, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def dash_document(seed, index, count):
+  """
+  The index'th of count generated Dash documents. Each depends only on seed and
+  index, so any shard can be generated on its own and the set is the same however
+  it is split. The first DASH_PROTOTYPES documents are prototypes of the others.
+  """
+  rng = random.Random(seed * 1000003 + index)
+  kind = rng.choices([kind for kind, weight in DASH_TYPES], [weight for kind, weight in DASH_TYPES])[0]
+  created = rng.uniform(0, 3 * 365 * 86400)
+  document = {
+    "id": dash_id(seed, index),
+    "title_t": ' '.join(rng.choices(DASH_WORDS, k=rng.randint(1, 5))),
+    "type_t": kind,
+    "author_t": rng.choice(DASH_AUTHORS),
+    "creationDate_d": dash_date(created),
+    "lastModified_d": dash_date(created + rng.uniform(0, 30 * 86400)),
+    "x_n": round(rng.uniform(-2000, 2000), 2),
+    "y_n": round(rng.uniform(-2000, 2000), 2),
+    "_width_n": rng.randint(50, 1200),
+    "_height_n": rng.randint(50, 900),
+    "zIndex_n": rng.randint(0, 10),
+    "isPrototype_b": index < DASH_PROTOTYPES
+  }
+  if index >= DASH_PROTOTYPES:
+    document["proto_i"] = dash_id(seed, rng.randrange(min(DASH_PROTOTYPES, count)))
+  if kind == 'rtf':
+    document["data_t"] = ' '.join(rng.choices(DASH_WORDS, k=rng.randint(10, 120)))
+  elif kind == 'collection':
+    document["data_l"] = [dash_id(seed, rng.randrange(count)) for _ in range(rng.randint(1, 20))]
+    document["_viewType_n"] = rng.randint(1, 8)
+  else:
+    document["data_t"] = "http://localhost:1050/files/%ss/%s.%s" % (kind, document["id"], {
+      'image': 'png', 'pdf': 'pdf', 'web': 'html'}[kind])
+  return document
+
+def post_json(url, body):
+  request = urllib.request.Request(url, data=json.dumps(body).encode('utf-8'),
+                                   headers={'Content-Type': 'application/json'})
+  with urllib.request.urlopen(request) as response:
+    response.read()
+
+def dash_shard(shard, start, stop, count, seed, folder=None, solr=None, batch_size=1000, commit_within=60000):
+  """
+  Generates documents start to stop, writing them to <folder>/dash_<shard>.json as a
+  Solr JSON update and/or posting them to the solr core URL in batches.
+  """
+  began = time.perf_counter()
+  out = open(os.path.join(folder, 'dash_%05d.json' % shard), 'w', encoding='utf8') if folder else None
+  batch = []
+  try:
+    if out:
+      out.write('[')
+    for index in range(start, stop):
+      document = dash_document(seed, index, count)
+      if out:
+        out.write((',\n' if index > start else '\n') + json.dumps(document))
+      if solr:
+        batch.append(document)
+        if len(batch) >= batch_size:
+          post_json('%s/update?commitWithin=%d' % (solr, commit_within), batch)
+          batch = []
+    if solr and batch:
+      post_json('%s/update?commitWithin=%d' % (solr, commit_within), batch)
+    if out:
+      out.write('\n]\n')
+  finally:
+    if out:
+      out.close()
+  return stop - start, time.perf_counter() - began
+
+def generate_dash(count, seed=0, shards=4, workers=None, folder=None, solr=None, batch_size=1000):
+  """
+  Generates count Dash documents in shards spread over a pool of processes.
+  """
+  if folder:
+    os.makedirs(folder, exist_ok=True)
+  size = -(-count // shards)
+  jobs = [(shard, shard * size, min(count, (shard + 1) * size)) for shard in range(shards) if shard * size < count]
+  began = time.perf_counter()
+  with ProcessPoolExecutor(max_workers=workers or min(shards, os.cpu_count() or 1)) as pool:
+    futures = [pool.submit(dash_shard, shard, start, stop, count, seed, folder, solr, batch_size)
+               for shard, start, stop in jobs]
+    for future in futures:
+      future.result()
+  if solr:
+    post_json('%s/update' % solr, {'commit': {}})
+  elapsed = time.perf_counter() - began
+  print("%d dash documents in %d shards in %.2f s, %.0f documents/s" % (count, len(jobs), elapsed, count / elapsed))
+
+def dash_queries(count, seed=0, documents=1000):
+  """
+  Yields count (kind, params) pairs for /select, a mix of the queries Dash's search
+  sends: free text, fielded text, prototype joins, filtered and sorted, and faceted.
+  """
+  rng = random.Random(seed)
+  for _ in range(count):
+    word = rng.choice(DASH_WORDS)
+    kind = rng.choices(['text', 'title', 'join', 'filtered', 'facet', 'id'], [40, 20, 10, 15, 10, 5])[0]
+    params = {'q': 'DEFAULT:%s' % word, 'rows': 10, 'wt': 'json'}
+    if kind == 'title':
+      params['q'] = 'title_t:%s' % word
+    elif kind == 'join':
+      params['q'] = '{!join from=id to=proto_i}*:* AND type_t:%s' % rng.choice(DASH_TYPES)[0]
+    elif kind == 'filtered':
+      x = rng.randint(-2000, 1500)
+      params['fq'] = 'x_n:[%d TO %d] AND isPrototype_b:false' % (x, x + 500)
+      params['sort'] = 'creationDate_d desc'
+    elif kind == 'facet':
+      params.update({'q': '*:*', 'rows': 0, 'facet': 'true', 'facet.field': 'author_t'})
+    elif kind == 'id':
+      params['q'] = 'id:"%s"' % dash_id(seed, rng.randrange(documents))
+    elif rng.random() < 0.5:
+      params.update({'hl': 'on', 'hl.fl': '*'})
+    yield kind, params
+
+def timed_query(solr, kind, params):
+  began = time.perf_counter()
+  try:
+    with urllib.request.urlopen('%s/select?%s' % (solr, urllib.parse.urlencode(params))) as response:
+      response.read()
+    failed = False
+  except (urllib.error.URLError, OSError):
+    failed = True
+  return kind, (time.perf_counter() - began) * 1000, failed
+
+def percentile(ordered, fraction):
+  return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def replay(solr, count, seed=0, documents=1000, clients=4):
+  """
+  Sends count generated queries to the core from clients threads at once and prints
+  latency percentiles for each kind of query.
+  """
+  latencies = {}
+  failures = 0
+  began = time.perf_counter()
+  with ThreadPoolExecutor(max_workers=clients) as pool:
+    for kind, elapsed, failed in pool.map(lambda query: timed_query(solr, *query),
+                                          dash_queries(count, seed, documents)):
+      failures += failed
+      latencies.setdefault(kind, []).append(elapsed)
+      latencies.setdefault('all', []).append(elapsed)
+  total = time.perf_counter() - began
+  print("%d queries in %.2f s (%.0f/s), %d failed" % (count, total, count / total, failures))
+  for kind, values in sorted(latencies.items()):
+    values.sort()
+    print("  %-9s %7d  p50 %7.1f ms  p90 %7.1f ms  p99 %7.1f ms  max %7.1f ms" % (
+      kind, len(values), percentile(values, 0.5), percentile(values, 0.9), percentile(values, 0.99), values[-1]))
 
 if __name__ == "__main__":
-  filmlist = []
-  cursor = do_query(filmlist)
-  i=0
-  while(cursor):
-      cursor = do_query(filmlist, cursor)
-      i = i+1
-      if i==MAX_ITERATIONS:
-          break
-
-  gen_json(filmlist)
-  gen_csv(filmlist)
-  gen_xml(filmlist)
+  parser = argparse.ArgumentParser(description="Write the films example data set")
+  parser.add_argument("--jsonl", action="store_true", help="write films.jsonl, one film per line, instead of films.json")
+  parser.add_argument("--synthetic", type=int, help="write this many generated films instead of querying Freebase")
+  parser.add_argument("--benchmark", type=int, nargs="+", help="time the writers on this many generated films")
+  parser.add_argument("--out", default=".", help="folder the files are written to")
+  parser.add_argument("--dash", type=int, help="generate this many documents for the dash core instead of films")
+  parser.add_argument("--seed", type=int, default=0, help="seed for --dash documents and --replay queries")
+  parser.add_argument("--shards", type=int, default=8, help="number of --dash shards, generated in parallel")
+  parser.add_argument("--workers", type=int, help="number of processes generating shards")
+  parser.add_argument("--no-files", action="store_true", help="with --dash and --solr, only post the documents")
+  parser.add_argument("--solr", help="post --dash documents to, and --replay queries against, this core "
+                                     "(e.g. http://localhost:8983/solr/dash)")
+  parser.add_argument("--batch-size", type=int, default=1000, help="documents per update posted to --solr")
+  parser.add_argument("--replay", type=int, help="send this many generated queries to --solr and report latencies")
+  parser.add_argument("--clients", type=int, default=4, help="number of queries --replay sends at once")
+  parser.add_argument("--service-url", default=service_url, help="the mqlread endpoint films are queried from")
+  parser.add_argument("--pages", type=int, default=MAX_ITERATIONS + 1, help="maximum number of pages queried")
+  parser.add_argument("--serve", type=int, metavar="PORT",
+                      help="serve films.json with the mqlread cursor protocol on this port instead")
+  args = parser.parse_args()
+
+  if args.serve is not None:
+    serve_stand_in(args.serve)
+    sys.exit()
+
+  if args.dash is not None or args.replay is not None:
+    if args.dash is not None:
+      generate_dash(args.dash, args.seed, args.shards, args.workers, None if args.no_files else args.out,
+                    args.solr, args.batch_size)
+    if args.replay is not None:
+      if args.solr is None:
+        parser.error("--replay needs --solr")
+      replay(args.solr, args.replay, args.seed, args.dash or 1000, args.clients)
+    sys.exit()
+
+  if args.benchmark is not None:
+    benchmark(args.benchmark, args.out, args.jsonl)
+    sys.exit()
+
+  if args.synthetic is not None:
+    films = synthetic_films(args.synthetic)
+  else:
+    films = query_films(PagingClient(args.service_url), args.pages)
+
+  write_films(films, open_writers(args.out, args.jsonl))
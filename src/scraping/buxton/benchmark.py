@@ -0,0 +1,376 @@
+"""
+Offline benchmark for the Buxton import pipeline. For every corpus size it
+generates synthetic device documents, times the individual stages (reading
+the .docx, parsing the text, storing and resizing images) and then runs the
+scraper and the jsonifier end to end, each in a fresh process so that peak
+RSS is measured per run. The scraper writes to mongomock by default, or to a
+throwaway database on a local mongod if --mongo is given a URI.
+
+usage: python benchmark.py [--sizes 10 100 1000] [--mongo mongodb://localhost:27017]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+from contextlib import redirect_stdout
+
+
+def peak_rss_mb():
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024
+
+
+def run_stages(root: str, variant_threads: int):
+    from PIL import Image
+    from docx_reader import read_docx
+    from buxton_parser import parse_device
+    from image_store import ImageStore
+    from variants import write_all_variants
+
+    source = f"{root}/source"
+    files = sorted(os.listdir(source))
+    timings = {}
+
+    start = time.perf_counter()
+    texts = [read_docx(f"{source}/{name}")["text"] for name in files]
+    timings["read_docx"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for text in texts:
+        parse_device(text)
+    timings["parse"] = time.perf_counter() - start
+
+    images_root = f"{root}/stage_images"
+    os.makedirs(images_root, exist_ok=True)
+    store = ImageStore(images_root, "http://localhost")
+    # icons are rejected from their headers inside the archive, so only the
+    # images the importer keeps are stored
+    start = time.perf_counter()
+    stored = []
+    for name in files:
+        stored.extend(read_docx(f"{source}/{name}", store, accept=lambda w, h: abs(w - h) >= 10)["images"])
+    timings["store_images"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sizes = [(image["width"], image["height"]) if "width" in image else Image.open(image["path"]).size
+             for image in stored]
+    timings["probe_images"] = time.perf_counter() - start
+
+    jobs = [(image["path"], f"{images_root}/{image['folder']}", image["file"], width)
+            for image, (width, height) in zip(stored, sizes) if image["new"] and abs(width - height) >= 10]
+    start = time.perf_counter()
+    write_all_variants(jobs, variant_threads)
+    timings["variants"] = time.perf_counter() - start
+
+    return {"stages": timings, "images": len(stored), "documents": len(files)}
+
+
+def run_scraper(root: str, mongo: str, workers: int, variant_threads: int):
+    import scraper
+    uri = mongo
+    if mongo == "mongomock":
+        import mongomock
+        scraper.MongoClient = mongomock.MongoClient
+        uri = "mongodb://localhost"
+    else:
+        import pymongo
+        pymongo.MongoClient(uri).drop_database("DashBenchmark")
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        session = scraper.main(["--source", f"{root}/source", "--files-path", f"{root}/files",
+                                "--manifest", f"{root}/manifest.json", "--trace", f"{root}/trace.jsonl",
+                                "--mongo-uri", uri, "--database", "DashBenchmark",
+                                "--workers", str(workers), "--variant-threads", str(variant_threads)])
+    elapsed = time.perf_counter() - start
+    with open(f"{root}/trace.jsonl") as trace:
+        aggregate = json.loads(trace.readlines()[-1])["aggregate"]
+    # imported source files, counted the way the jsonifier's records are,
+    # apart from the Mongo documents written for them
+    files = [name for name, entry in session.manifest.files.items()
+             if not name.startswith("<") and entry["digest"] is not None]
+    return {
+        "seconds": elapsed,
+        "files": len(files),
+        "mongo_documents": session.collection.count_documents({}),
+        "images": session.image_references,
+        "stages": {stage: total["seconds"] for stage, total in aggregate["stages"].items()}
+    }
+
+
+def run_jsonifier(root: str, workers: int, variant_threads: int):
+    import jsonifier
+    os.makedirs(f"{root}/json", exist_ok=True)
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        jsonifier.main(["--source", f"{root}/source", "--files-path", f"{root}/files",
+                        "--json-path", f"{root}/json", "--jsonl",
+                        "--workers", str(workers), "--variant-threads", str(variant_threads)])
+    elapsed = time.perf_counter() - start
+    images = 0
+    files = 0
+    from jsonl import read_records
+    for record in read_records(f"{root}/json/buxton_collection.jsonl"):
+        files += 1
+        images += len(record["extracted_images"])
+    return {"seconds": elapsed, "files": files, "images": images}
+
+
+def dict_documents(count: int):
+    """
+    The text and image documents the scraper wrote before dash_model, built
+    the same way: as nested dicts holding every shared field themselves.
+    """
+    documents = []
+    for i in range(count):
+        content = f"caption {i} with a \"quote\""
+        documents.append({"_id": f"view{i}", "fields": {
+            "proto": {"fieldId": f"data{i}", "__type": "proxy"}, "x": 10, "y": 10, "_width": 400, "zIndex": 2
+        }, "__type": "Doc"})
+        documents.append({"_id": f"data{i}", "fields": {
+            "proto": {"fieldId": "textProto", "__type": "proxy"},
+            "data": {"Data": json.dumps({"doc": {"type": "doc", "content": [{"type": "paragraph", "content": [
+                {"type": "text", "text": content}]}]}, "selection": {"type": "text", "anchor": 1, "head": 1}},
+                separators=(",", ":"), ensure_ascii=False), "Text": content, "__type": "RichTextField"},
+            "title": content, "_nativeWidth": 200, "author": "Bill Buxton",
+            "creationDate": {"date": i, "__type": "date"}, "isPrototype": True, "_autoHeight": True,
+            "page": -1, "_nativeHeight": 200, "_height": 200, "data_text": content
+        }, "__type": "Doc"})
+        documents.append({"_id": f"image{i}", "fields": {
+            "proto": {"fieldId": "imageProto", "__type": "proxy"},
+            "data": {"url": f"http://localhost/{i}.png", "__type": "image"}, "title": f"image{i}.png",
+            "_nativeWidth": 640, "author": "Bill Buxton", "creationDate": {"date": i, "__type": "date"},
+            "isPrototype": True, "page": -1, "_nativeHeight": 480, "_height": 480
+        }, "__type": "Doc"})
+    return documents
+
+
+def model_documents(count: int):
+    import scraper
+    from dash_model import Proxy, Date, ImageField, RichTextField
+    documents = []
+    for i in range(count):
+        content = f"caption {i} with a \"quote\""
+        documents.append(scraper.CHILD_VIEW.doc(f"view{i}", Proxy(f"data{i}")))
+        documents.append(scraper.TEXT_DATA.doc(f"data{i}", RichTextField(content), content, Date(i), content))
+        documents.append(scraper.IMAGE_DATA.doc(f"image{i}", ImageField(f"http://localhost/{i}.png"),
+                                                f"image{i}.png", 640, Date(i), 480, 480))
+    return documents
+
+
+def run_model(count: int):
+    """
+    Compares holding count text and image document sets as nested dicts
+    with holding them as dash_model documents, and the time it takes to
+    build each and to get from each to what is sent to the database. The
+    importers serialize every document as soon as it is built, so the
+    memory held by the model is only saved while documents are kept as
+    model objects, which the import itself does not do.
+    """
+    import gc
+    import tracemalloc
+    results = {}
+    for name, build in [("dicts", dict_documents), ("model", model_documents)]:
+        build(1)
+        gc.collect()
+        start = time.perf_counter()
+        documents = build(count)
+        built = time.perf_counter() - start
+        start = time.perf_counter()
+        # dicts were handed to the database as they were built
+        if name == "model":
+            for document in documents:
+                document.bson()
+        serialized = time.perf_counter() - start
+        del documents
+        gc.collect()
+        # measured apart from the timings, which tracing would slow down
+        tracemalloc.start()
+        documents = build(count)
+        held = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results[name] = {
+            "documents": len(documents),
+            "bytes_per_document": held / len(documents),
+            "build_us_per_document": built / len(documents) * 1e6,
+            "serialize_us_per_document": serialized / len(documents) * 1e6
+        }
+        del documents
+    return results
+
+
+def report_model(results):
+    for name, run in results.items():
+        print(f"{name:<8}{run['documents']:9d} documents {run['bytes_per_document']:9.0f} bytes/doc held "
+              f"{run['build_us_per_document']:7.2f} us/doc to build "
+              f"{run['serialize_us_per_document']:7.2f} us/doc to serialize "
+              f"{run['build_us_per_document'] + run['serialize_us_per_document']:7.2f} us/doc in all")
+
+
+def analysis_images(count: int, seed: int = 0):
+    """
+    Builds count encoded images with what each should be taken for: photos
+    of several shapes, square ones included, as PNG and as JPEG, with
+    blank spacers and flat logos among them.
+    """
+    import io
+    import random
+    from PIL import Image
+    from synthetic_docx import png, flat_png
+    rng = random.Random(seed)
+    shapes = [(640, 480), (480, 640), (500, 500), (1200, 400), (300, 300)]
+    images = []
+    for i in range(count):
+        kind = i % 10
+        if kind == 8:
+            images.append(("spacer", flat_png(600, 12, rng, mark=False)))
+        elif kind == 9:
+            images.append(("logo", flat_png(320, 160, rng)))
+        else:
+            data = png(*shapes[kind % len(shapes)], rng)
+            if kind % 2 == 1:
+                out = io.BytesIO()
+                Image.open(io.BytesIO(data)).save(out, "JPEG", quality=85)
+                data = out.getvalue()
+            images.append(("photo", data))
+    return images
+
+
+def run_analysis(count: int, batch_size: int = 64):
+    """
+    Times image_analysis over count synthetic images in batches, and
+    compares what it keeps with what the near-square rule kept.
+    """
+    import io
+    from PIL import Image
+    from image_analysis import analyze_batch, is_picture
+    images = analysis_images(count)
+    sizes = [Image.open(io.BytesIO(data)).size for _, data in images]
+    start = time.perf_counter()
+    features = []
+    for i in range(0, count, batch_size):
+        batch = images[i:i + batch_size]
+        features.extend(analyze_batch([lambda data=data: io.BytesIO(data) for _, data in batch],
+                                      sizes[i:i + batch_size]))
+    elapsed = time.perf_counter() - start
+    kept = {"analysis": {}, "near-square rule": {}}
+    for (kind, _), size, described in zip(images, sizes, features):
+        for rule, keep in [("analysis", is_picture(described)), ("near-square rule", abs(size[0] - size[1]) >= 10)]:
+            totals = kept[rule].setdefault(kind, [0, 0])
+            totals[0] += keep
+            totals[1] += 1
+    return {
+        "images": count,
+        "seconds": elapsed,
+        "images_per_second": count / elapsed,
+        "kept": {rule: {kind: f"{k} of {n}" for kind, (k, n) in totals.items()} for rule, totals in kept.items()}
+    }
+
+
+def run_child(args):
+    """
+    Runs a single measurement in this process and prints it as JSON.
+    """
+    root = args.root
+    os.makedirs(f"{root}/files/images", exist_ok=True)
+    if args.child == "stages":
+        result = run_stages(root, args.variant_threads)
+    elif args.child == "scraper":
+        result = run_scraper(root, args.mongo, args.workers, args.variant_threads)
+    else:
+        result = run_jsonifier(root, args.workers, args.variant_threads)
+    result["peak_rss_mb"] = peak_rss_mb()
+    print(json.dumps(result))
+
+
+def measure(kind: str, root: str, args):
+    shutil.rmtree(f"{root}/files", ignore_errors=True)
+    shutil.rmtree(f"{root}/stage_images", ignore_errors=True)
+    if os.path.exists(f"{root}/manifest.json"):
+        os.remove(f"{root}/manifest.json")
+    command = [sys.executable, os.path.abspath(__file__), "--child", kind, "--root", root,
+               "--mongo", args.mongo, "--workers", str(args.workers),
+               "--variant-threads", str(args.variant_threads)]
+    output = subprocess.run(command, check=True, capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def report(size: int, stages, scraper, jsonifier):
+    print(f"\n{size} documents, {stages['images']} embedded images")
+    for stage, seconds in stages["stages"].items():
+        print(f"  {stage:<14}{seconds:9.3f} s  {seconds / size * 1000:9.2f} ms/doc")
+    print(f"  {'(peak rss)':<14}{stages['peak_rss_mb']:9.1f} MB")
+    for name, run in [("scraper", scraper), ("jsonifier", jsonifier)]:
+        seconds = run["seconds"]
+        mongo = f"{run['mongo_documents']:9d}" if "mongo_documents" in run else f"{'-':>9}"
+        print(f"  {name:<14}{seconds:9.3f} s  {run['files'] / seconds:9.1f} files/s  "
+              f"{run['images'] / seconds:9.1f} images/s  {mongo} mongo docs  {run['peak_rss_mb']:9.1f} MB peak")
+    for stage, seconds in scraper["stages"].items():
+        print(f"    scraper {stage:<18}{seconds:9.3f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Buxton importers on synthetic documents")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--images", type=int, default=3)
+    parser.add_argument("--image-size", default="640x480")
+    parser.add_argument("--shared", type=float, default=0.1)
+    parser.add_argument("--mongo", default="mongomock",
+                        help="'mongomock', or the URI of a local mongod to use a throwaway database on")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--variant-threads", type=int, default=4)
+    parser.add_argument("--json", help="also write the raw results to this file")
+    parser.add_argument("--analysis", type=int, metavar="N",
+                        help="instead, time the image content analysis over N synthetic images (needs numpy)")
+    parser.add_argument("--model", type=int, metavar="N",
+                        help="instead, compare N sets of text and image documents held as dicts and as dash_model")
+    parser.add_argument("--child", choices=["stages", "scraper", "jsonifier"], help=argparse.SUPPRESS)
+    parser.add_argument("--root", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        run_child(args)
+        return
+    if args.analysis is not None:
+        results = run_analysis(args.analysis)
+        print(f"analyzed {results['images']} images in {results['seconds']:.2f} s, "
+              f"{results['images_per_second']:.0f} images/s")
+        for rule, kinds in results["kept"].items():
+            print(f"  {rule:<18}kept " + ", ".join(f"{kept} {kind}s" for kind, kept in kinds.items()))
+        if args.json is not None:
+            with open(args.json, "w") as out:
+                json.dump(results, out, indent=4)
+        return
+    if args.model is not None:
+        results = run_model(args.model)
+        report_model(results)
+        if args.json is not None:
+            with open(args.json, "w") as out:
+                json.dump(results, out, indent=4)
+        return
+
+    from synthetic_docx import generate, image_size
+    results = []
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory(prefix="buxton_benchmark_") as root:
+            generate(f"{root}/source", size, images=args.images,
+                     image_size=image_size(args.image_size), shared=args.shared)
+            stages = measure("stages", root, args)
+            scraper = measure("scraper", root, args)
+            jsonifier = measure("jsonifier", root, args)
+            report(size, stages, scraper, jsonifier)
+            results.append({"size": size, "stages": stages, "scraper": scraper, "jsonifier": jsonifier})
+    if args.json is not None:
+        with open(args.json, "w") as out:
+            json.dump(results, out, indent=4)
+
+
+if __name__ == "__main__":
+    main()
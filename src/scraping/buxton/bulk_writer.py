@@ -0,0 +1,148 @@
+import time
+import asyncio
+from pymongo import InsertOne, ReplaceOne, UpdateOne, DeleteMany
+
+
+class BulkWriter:
+    """
+    Buffers document writes and sends them to the target
+    collection as unordered bulk writes of at most batch_size
+    operations, recording how long each batch took.
+    """
+
+    def __init__(self, collection, batch_size: int = 1000, verbose: bool = True):
+        self.collection = collection
+        self.batch_size = max(1, batch_size)
+        self.verbose = verbose
+        self.pending = []
+        self.latencies = []
+        self.written = 0
+
+    def insert(self, document):
+        self._add(InsertOne(document))
+
+    def upsert(self, document):
+        self._add(ReplaceOne({"_id": document["_id"]}, document, upsert=True))
+
+    def delete(self, ids):
+        if len(ids) > 0:
+            self._add(DeleteMany({"_id": {"$in": list(ids)}}))
+
+    def _add(self, operation):
+        self.pending.append(operation)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def _take(self):
+        batch = self.pending[:self.batch_size]
+        self.pending = self.pending[self.batch_size:]
+        return batch
+
+    def update_one(self, filter, update):
+        # updates usually refer to documents inserted earlier, and an
+        # unordered batch makes no guarantees, so write those out first
+        self.flush()
+        self._write([UpdateOne(filter, update)])
+
+    def flush(self):
+        while len(self.pending) > 0:
+            self._write(self._take())
+
+    def _write(self, batch):
+        start = time.perf_counter()
+        self.collection.bulk_write(batch, ordered=False)
+        self._record(batch, start)
+
+    def _record(self, batch, start):
+        elapsed = (time.perf_counter() - start) * 1000
+        self.latencies.append(elapsed)
+        self.written += len(batch)
+        if self.verbose:
+            print(f"wrote batch of {len(batch)} in {elapsed:.1f} ms")
+
+    def report(self):
+        batches = len(self.latencies)
+        if batches == 0:
+            return "no batches written"
+        ordered = sorted(self.latencies)
+        total = sum(ordered)
+        p95 = ordered[min(batches - 1, int(batches * 0.95))]
+        return (f"{self.written} writes in {batches} batches, "
+                f"{total:.1f} ms total, {total / batches:.1f} ms mean, "
+                f"{p95:.1f} ms p95, {ordered[-1]:.1f} ms max")
+
+
+class AsyncBulkWriter(BulkWriter):
+    """
+    A BulkWriter for an asyncio driver's collection, such as motor's.
+    Full batches are sent in the background while the caller carries on
+    building documents; drain() holds the caller back while more than
+    max_in_flight batches are outstanding, and flush() waits for them all.
+    Deletes are held back and written, and waited for, by the next drain()
+    or flush(), so that they never share a batch, or run alongside one,
+    with writes queued after them. The first failed batch is raised from
+    the next drain() or flush().
+    """
+
+    def __init__(self, collection, batch_size: int = 1000, max_in_flight: int = 4, verbose: bool = True):
+        super().__init__(collection, batch_size, verbose)
+        self.max_in_flight = max(1, max_in_flight)
+        self.in_flight = set()
+        self.deletes = []
+        self.error = None
+
+    def delete(self, ids):
+        # an unordered batch runs its deletes after its updates, so a
+        # document one file stops producing and a later file produces
+        # would otherwise be written and then removed
+        if len(ids) > 0:
+            self.deletes.append(DeleteMany({"_id": {"$in": list(ids)}}))
+
+    def _add(self, operation):
+        self.pending.append(operation)
+        if len(self.pending) >= self.batch_size:
+            self._send(self._take())
+
+    def _send(self, batch):
+        task = asyncio.ensure_future(self._write(batch))
+        self.in_flight.add(task)
+        task.add_done_callback(self._sent)
+
+    def _sent(self, task):
+        self.in_flight.discard(task)
+        if not task.cancelled() and task.exception() is not None and self.error is None:
+            self.error = task.exception()
+
+    def _raise(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    async def _write_deletes(self):
+        while len(self.deletes) > 0:
+            batch = self.deletes[:self.batch_size]
+            self.deletes = self.deletes[self.batch_size:]
+            await self._write(batch)
+
+    async def drain(self):
+        await self._write_deletes()
+        while len(self.in_flight) > self.max_in_flight:
+            await asyncio.wait(self.in_flight, return_when=asyncio.FIRST_COMPLETED)
+        self._raise()
+
+    async def update_one(self, filter, update):
+        await self.flush()
+        await self._write([UpdateOne(filter, update)])
+
+    async def flush(self):
+        while len(self.pending) > 0:
+            self._send(self._take())
+        if len(self.in_flight) > 0:
+            await asyncio.wait(self.in_flight)
+        await self._write_deletes()
+        self._raise()
+
+    async def _write(self, batch):
+        start = time.perf_counter()
+        await self.collection.bulk_write(batch, ordered=False)
+        self._record(batch, start)
@@ -0,0 +1,138 @@
+import os
+import gzip
+import shutil
+import json
+from collections import deque
+from staging import proxy_targets
+
+
+def closure(root_id: str, documents: dict):
+    """
+    Returns the documents reachable from root_id through proxies, root
+    first and breadth first. Targets that are not among documents, such
+    as the client's prototypes, are left out.
+    """
+    found = []
+    seen = set()
+    pending = deque([root_id])
+    while len(pending) > 0:
+        id = pending.popleft()
+        if id in seen or id not in documents:
+            continue
+        seen.add(id)
+        document = documents[id]
+        found.append(document)
+        targets = set()
+        proxy_targets(document.get("fields"), targets)
+        pending.extend(sorted(targets))
+    return found
+
+
+class BundleStore:
+    """
+    Writes every document reachable from a collection's view, stored
+    between begin() and end() or kept by share(), to a gzipped JSON file at
+    <root>/<view id>.json.gz. A staged store writes beside root and only
+    moves its bundles into place on promote().
+    """
+
+    def __init__(self, root: str, base_url: str, staged: bool = False):
+        self.root = root
+        self.base_url = base_url.rstrip("/")
+        self.staging = f"{root}.staging" if staged else None
+        self.removed = set()
+        self.collected = None
+        self.shared = {}
+        self.written = 0
+        self.changed = False
+        os.makedirs(root, exist_ok=True)
+        if self.staging is not None:
+            shutil.rmtree(self.staging, True)
+            os.makedirs(self.staging)
+
+    def path(self, root_id: str, folder: str = None):
+        return f"{folder or self.root}/{root_id}.json.gz"
+
+    def current(self, root_id: str):
+        """
+        Returns where the bundle of root_id is as of this import, or None.
+        """
+        if self.staging is not None:
+            if os.path.exists(self.path(root_id, self.staging)):
+                return self.path(root_id, self.staging)
+            if root_id in self.removed:
+                return None
+        return self.path(root_id) if os.path.exists(self.path(root_id)) else None
+
+    def url(self, root_id: str):
+        return f"{self.base_url}/{root_id}.json.gz"
+
+    def begin(self):
+        self.collected = {}
+
+    def add(self, document):
+        if self.collected is not None:
+            self.collected[document["_id"]] = document
+
+    def share(self):
+        """
+        Keeps the documents collected since begin() for every later bundle.
+        """
+        self.shared.update(self.collected)
+        self.collected = None
+
+    def end(self, root_id: str):
+        documents = closure(root_id, {**self.shared, **self.collected})
+        self.collected = None
+        path = self.path(root_id, self.staging)
+        temp = path + ".tmp"
+        with gzip.open(temp, "wt", encoding="utf-8") as out:
+            json.dump({"root": root_id, "documents": documents}, out, separators=(",", ":"), default=str)
+        os.replace(temp, path)
+        self.removed.discard(root_id)
+        self.written += 1
+        self.changed = True
+        return len(documents)
+
+    def discard(self):
+        self.collected = None
+
+    def exists(self, root_id: str):
+        return self.current(root_id) is not None
+
+    def load(self, root_id: str):
+        path = self.current(root_id)
+        if path is None:
+            return []
+        with gzip.open(path, "rt", encoding="utf-8") as bundle:
+            return json.load(bundle)["documents"]
+
+    def remove(self, root_id: str):
+        if root_id is None or not self.exists(root_id):
+            return
+        self.changed = True
+        if self.staging is None:
+            os.remove(self.path(root_id))
+            return
+        self.removed.add(root_id)
+        if os.path.exists(self.path(root_id, self.staging)):
+            os.remove(self.path(root_id, self.staging))
+
+    def promote(self, replace: bool = False):
+        """
+        Moves the staged bundles into place and deletes the removed ones,
+        or, if replace, every bundle this import did not write.
+        """
+        written = set(os.listdir(self.staging))
+        for name in os.listdir(self.root):
+            if name not in written and (replace or name[:-len(".json.gz")] in self.removed):
+                os.remove(f"{self.root}/{name}")
+        for name in written:
+            os.replace(f"{self.staging}/{name}", f"{self.root}/{name}")
+        os.rmdir(self.staging)
+
+    def abandon(self):
+        shutil.rmtree(self.staging, True)
+
+    def report(self):
+        return f"{self.written} bundles written to {self.root}"
@@ -0,0 +1,264 @@
+import re
+import sys
+import timeit
+from dataclasses import dataclass, field, asdict
+from typing import List, Optional
+
+# every character sanitize used to fix one line at a time, replaced across
+# the whole document text in a single pass (str.translate takes a slow path
+# for non-ASCII tables and is no faster than the old per-line replaces)
+REPLACEMENTS = {
+    "\t": "",
+    "\u00A0": " ",
+    "\u2013": "-",
+    "\u201c": '"',
+    "\u201d": '"'
+}
+NORMALIZE = re.compile("[" + "".join(REPLACEMENTS) + "]")
+
+PRICE = re.compile(r"\$([0-9.]*)")
+DIMENSIONS = "dimensions"
+SHORT_DESCRIPTION = "Short Description: "
+
+
+@dataclass
+class DeviceRecord:
+    title: str
+    short_description: str
+    buxton_notes: str = ""
+    company: str = ""
+    year: Optional[int] = None
+    original_price: Optional[float] = None
+    degrees_of_freedom: Optional[int] = None
+    dimensions: str = "N/A"
+    primary_key: str = ""
+    secondary_key: str = ""
+    link_descriptions: List[str] = field(default_factory=list)
+    table_image_names: List[str] = field(default_factory=list)
+    captions: List[str] = field(default_factory=list)
+    notes: List[str] = field(default_factory=list)
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def normalize(text: str):
+    """
+    Splits a document's text into the non-trivial, sanitized lines the
+    section parser works through.
+    """
+    lines = NORMALIZE.sub(lambda match: REPLACEMENTS[match.group()], text).split("\n")
+    return [line for line in (line.strip() for line in lines) if len(line) > 1]
+
+
+def extract_value(kv_string: str):
+    pieces = kv_string.split(":")
+    return (pieces[1] if len(pieces) > 1 else kv_string).strip()
+
+
+def try_parse(to_parse: str):
+    try:
+        return int(to_parse)
+    except ValueError:
+        return None
+
+
+def sanitize_price(raw: str):
+    raw = raw.replace(",", "")
+    if "x" in raw.lower():
+        return None
+    match = PRICE.search(raw)
+    if match is not None:
+        return float(match.group(1)) if len(match.group(1)) > 0 else None
+    elif raw.lower().find("nfs"):
+        return -1
+    else:
+        return None
+
+
+def parse_header(record: DeviceRecord, lines: List[str]):
+    record.title = lines[2]
+    record.short_description = lines[3].replace(SHORT_DESCRIPTION, "")
+    record.buxton_notes = " ".join(lines[5:])
+
+
+def parse_details(record: DeviceRecord, lines: List[str]):
+    clean = [data.strip().split(":") for data in lines[0].split("|")]
+    record.company = clean[0][-1].strip()
+    record.year = try_parse(clean[1][-1].strip())
+    record.original_price = sanitize_price(clean[2][-1].strip())
+    record.degrees_of_freedom = try_parse(extract_value(lines[1]).replace("NA", "N/A"))
+    if len(lines) > 2 and lines[2].lower().startswith(DIMENSIONS):
+        dimensions = [lines[2].lower()[len(DIMENSIONS) + 1:].strip()] + lines[3:]
+        record.dimensions = " ".join(dimensions)
+
+
+def parse_key_words(record: DeviceRecord, lines: List[str]):
+    record.primary_key = extract_value(lines[0])
+    record.secondary_key = " ".join(extract_value(line) for line in lines[1:])
+
+
+def parse_links(record: DeviceRecord, lines: List[str]):
+    record.link_descriptions = lines
+
+
+def parse_images(record: DeviceRecord, lines: List[str]):
+    # the first two lines are the table's column headers
+    rows = lines[2:]
+    for i in range(0, len(rows) - 1, 2):
+        record.table_image_names.append(rows[i])
+        record.captions.append(rows[i + 1])
+
+
+def parse_notes(record: DeviceRecord, lines: List[str]):
+    record.notes = lines
+
+
+# each section runs from its heading up to the next heading that is present,
+# and headings are searched for in this order
+SECTIONS = [
+    (None, parse_header, True),
+    ("Device Details", parse_details, True),
+    ("Key Words", parse_key_words, True),
+    ("Links", parse_links, True),
+    ("Image", parse_images, True),
+    ("NOTES:", parse_notes, False)
+]
+
+
+def parse_device(text: str):
+    """
+    Parses the text of a device document into a DeviceRecord, raising a
+    ValueError that names the section at fault if the document does not
+    follow the template.
+    """
+    lines = normalize(text)
+    starts = []
+    cur = 0
+    for heading, _, required in SECTIONS:
+        if heading is None:
+            starts.append(0)
+            continue
+        try:
+            cur = lines.index(heading, cur)
+            starts.append(cur)
+        except ValueError:
+            if required:
+                raise ValueError(f"missing the \"{heading}\" section")
+            starts.append(None)
+    record = DeviceRecord("", "")
+    present = [(start, section) for start, section in zip(starts, SECTIONS) if start is not None]
+    for i, (start, (heading, handler, _)) in enumerate(present):
+        end = present[i + 1][0] if i + 1 < len(present) else len(lines)
+        body = lines[start + (0 if heading is None else 1):end]
+        try:
+            handler(record, body)
+        except IndexError:
+            raise ValueError(f"the \"{heading or 'header'}\" section is incomplete")
+    return record
+
+
+def legacy_lines(text: str):
+    def sanitize(line): return re.sub("[\n\t]+", "", line).replace(u"\u00A0", " ").replace(
+        u"\u2013", "-").replace(u"\u201c", '''"''').replace(u"\u201d", '''"''').strip()
+    return [line for line in map(sanitize, text.split("\n")) if len(line) > 1]
+
+
+def benchmark(texts, number: int = 200):
+    """
+    Prints the mean cost per document of normalizing (next to the per-line
+    sanitize it replaces) and of parsing the given document texts.
+    """
+    def per_document(statement):
+        seconds = min(timeit.repeat(statement, number=number, repeat=5))
+        return seconds / (number * len(texts)) * 1e6
+
+    legacy = per_document(lambda: [legacy_lines(text) for text in texts])
+    normalized = per_document(lambda: [normalize(text) for text in texts])
+    parsed = per_document(lambda: [parse_device(text) for text in texts])
+    print(f"{len(texts)} documents, {number} rounds")
+    print(f"per-line sanitize: {legacy:9.1f} us/doc")
+    print(f"normalize:         {normalized:9.1f} us/doc")
+    print(f"normalize + parse: {parsed:9.1f} us/doc")
+
+
+SAMPLE = "\n\n".join([
+    "The Buxton Collection", "Device", "Sample Device", "Short Description: A sample\u00A0device",
+    "Long Description", "Notes about\tthe device \u2013 \u201cquoted\u201d", "Device Details",
+    "Company: Acme | Year: 1984 | Original Price: $1,299.00", "Degrees of Freedom: 2",
+    "Dimensions: 10 x 20", "x 5 cm", "Key Words", "Primary: keyboard", "Secondary: chord",
+    "Links", "Product brochure", "Video demo", "Image", "File Name", "Caption",
+    "image1.png", "Front view", "image2.png", "Side view", "NOTES:", "A note"
+])
+
+# what SAMPLE parses into; tabs are dropped rather than turned into spaces,
+# as the importers always did
+SAMPLE_RECORD = DeviceRecord(
+    title="Sample Device", short_description="A sample device", buxton_notes='Notes aboutthe device - "quoted"',
+    company="Acme", year=1984, original_price=1299.0, degrees_of_freedom=2, dimensions="10 x 20 x 5 cm",
+    primary_key="keyboard", secondary_key="chord", link_descriptions=["Product brochure", "Video demo"],
+    table_image_names=["image1.png", "image2.png"], captions=["Front view", "Side view"], notes=["A note"])
+# SAMPLE with an unreadable year and price and a secondary key over two
+# lines, which is joined once (the old parser repeated its first line) and
+# whose price is None (the old parser stored NaN)
+IRREGULAR = (SAMPLE.replace("Year: 1984", "Year: unknown").replace("$1,299.00", "NFS")
+             .replace("Secondary: chord", "Secondary: chord\n\nSecondary: pad"))
+IRREGULAR_RECORD = DeviceRecord(**{**SAMPLE_RECORD.to_dict(), "year": None, "original_price": None,
+                                   "secondary_key": "chord pad"})
+
+
+def compare(name: str, record: DeviceRecord, expected: dict):
+    for key, value in expected.items():
+        actual = getattr(record, key)
+        if actual != value:
+            raise AssertionError(f"{name}: {key} is {actual!r}, expected {value!r}")
+
+
+def check():
+    """
+    Checks that the section table still parses the samples above, and a
+    document written by synthetic_docx, into the records the importers
+    expect, raising an AssertionError that names the first field that
+    does not.
+    """
+    import tempfile
+    import synthetic_docx
+    from docx_reader import read_docx
+    compare("SAMPLE", parse_device(SAMPLE), SAMPLE_RECORD.to_dict())
+    compare("IRREGULAR", parse_device(IRREGULAR), IRREGULAR_RECORD.to_dict())
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = f"{folder}/device.docx"
+        synthetic_docx.write_device(path, 7, images=3, image_size=(16, 12), icons=1)
+        record = parse_device(read_docx(path)["text"])
+    # the values themselves are random, but where they land is not
+    captions = set(synthetic_docx.CAPTIONS)
+    holds = {
+        "title": record.title.endswith(" 7"),
+        "company": record.company in synthetic_docx.COMPANIES,
+        "year": isinstance(record.year, int),
+        "original_price": isinstance(record.original_price, float),
+        "degrees_of_freedom": isinstance(record.degrees_of_freedom, int),
+        "dimensions": re.fullmatch(r"\d+ x \d+ x \d+ cm", record.dimensions) is not None,
+        "primary_key": len(record.primary_key.split()) == 2,
+        "secondary_key": len(record.secondary_key.split()) == 4,
+        "link_descriptions": len(record.link_descriptions) == 2 and set(record.link_descriptions) <= captions,
+        "table_image_names": record.table_image_names == ["image1.png", "image2.png", "image3.png"],
+        "captions": len(record.captions) == 3 and set(record.captions) <= captions,
+        "notes": len(record.notes) == 1 and len(record.notes[0].split()) == 12
+    }
+    for key, held in holds.items():
+        if not held:
+            raise AssertionError(f"synthetic: {key} is {getattr(record, key)!r}")
+    print("buxton_parser: samples and synthetic document parse as expected")
+
+
+if __name__ == "__main__":
+    # usage: python buxton_parser.py [--check | file.docx ...]
+    if sys.argv[1:] == ["--check"]:
+        check()
+    elif len(sys.argv) > 1:
+        from docx_reader import read_docx
+        benchmark([read_docx(path)["text"] for path in sys.argv[1:]])
+    else:
+        benchmark([SAMPLE])
@@ -0,0 +1,143 @@
+"""
+Compact values for the documents the importers write. Every Dash field
+wrapper (proxies, lists, dates, images and rich text) is a small __slots__
+object, and the fields that every document of a kind shares are kept once,
+in a Template, so that a document only holds the values that are its own.
+bson() turns a document into the nested dicts the database expects in a
+single pass over its fields.
+"""
+
+import json
+
+SLOT = object()
+SCALARS = (str, int, float, bool, type(None))
+
+
+def rich_text(content):
+    # serialized rather than pasted into a template, so that quotes,
+    # backslashes and line breaks in the content stay valid JSON
+    return json.dumps({
+        "doc": {"type": "doc", "content": [{"type": "paragraph", "content": [{"type": "text", "text": content}]}]},
+        "selection": {"type": "text", "anchor": 1, "head": 1}
+    }, separators=(",", ":"), ensure_ascii=False)
+
+
+class Proxy:
+    __slots__ = ("field_id",)
+    kind = "proxy"
+
+    def __init__(self, field_id: str):
+        self.field_id = field_id
+
+    def bson(self):
+        return {"fieldId": self.field_id, "__type": self.kind}
+
+
+class PrefetchProxy(Proxy):
+    __slots__ = ()
+    kind = "prefetch_proxy"
+
+
+class List:
+    __slots__ = ("items",)
+
+    def __init__(self, items):
+        self.items = items
+
+    def bson(self):
+        return {"fields": [bson(item) for item in self.items], "__type": "list"}
+
+
+class Date:
+    __slots__ = ("date",)
+
+    def __init__(self, date):
+        self.date = date
+
+    def bson(self):
+        return {"date": self.date, "__type": "date"}
+
+
+class ImageField:
+    __slots__ = ("url",)
+
+    def __init__(self, url: str):
+        self.url = url
+
+    def bson(self):
+        return {"url": self.url, "__type": "image"}
+
+
+class RichTextField:
+    __slots__ = ("text",)
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def bson(self):
+        # Text is the plain text the client shows, searches and checks for emptiness
+        return {"Data": rich_text(self.text), "Text": self.text, "__type": "RichTextField"}
+
+
+class Template:
+    """
+    The ordered fields of a kind of document. Fields given as SLOT are
+    filled per document, in order, by Template.doc; every other value is
+    shared by all the documents made from the template.
+    """
+    __slots__ = ("items", "slots")
+
+    def __init__(self, **fields):
+        # scalars need no conversion, so they are marked as such up front
+        self.items = tuple((key, value, value is SLOT or type(value) not in SCALARS) for key, value in fields.items())
+        self.slots = sum(1 for _, value, _ in self.items if value is SLOT)
+
+    def extend(self, **fields):
+        """
+        Returns a template with these fields following this one's.
+        """
+        extended = Template()
+        extended.items = self.items + Template(**fields).items
+        extended.slots = self.slots + sum(1 for value in fields.values() if value is SLOT)
+        return extended
+
+    def doc(self, id: str, *values):
+        if len(values) != self.slots:
+            raise ValueError(f"expected {self.slots} field values, got {len(values)}")
+        return Doc(id, values, self)
+
+
+class Doc:
+    """
+    A document, either made from a template, in which case fields is the
+    tuple of its slot values, or given a dict of fields of its own.
+    """
+    __slots__ = ("id", "fields", "template")
+
+    def __init__(self, id: str, fields=None, template: Template = None):
+        self.id = id
+        self.fields = {} if fields is None else fields
+        self.template = template
+
+    def bson(self):
+        if self.template is None:
+            fields = {key: bson(value) for key, value in self.fields.items()}
+        else:
+            values = iter(self.fields)
+            fields = {}
+            for key, value, convert in self.template.items:
+                if value is SLOT:
+                    value = next(values)
+                fields[key] = bson(value) if convert else value
+        return {"_id": self.id, "fields": fields, "__type": "Doc"}
+
+
+def bson(value):
+    kind = type(value)
+    if kind in SCALARS:
+        return value
+    if kind is dict:
+        return {key: bson(item) for key, item in value.items()}
+    if kind is list:
+        return [bson(item) for item in value]
+    return value.bson()
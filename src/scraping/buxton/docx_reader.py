@@ -0,0 +1,164 @@
+import os
+import re
+from zipfile import ZipFile
+import xml.etree.ElementTree as ET
+from contextlib import nullcontext
+from functools import partial
+from image_probe import probe_size
+
+WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+RELS_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+HYPERLINK = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/hyperlink"
+IMAGE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/image"
+IMAGE_EXT = (".jpg", ".jpeg", ".png", ".bmp")
+
+TEXT = WORD_NS + "t"
+TAB = WORD_NS + "tab"
+BREAKS = (WORD_NS + "br", WORD_NS + "cr")
+PARAGRAPH = WORD_NS + "p"
+TABLE = WORD_NS + "tbl"
+ROW = WORD_NS + "tr"
+CELL = WORD_NS + "tc"
+# pictures refer to their media member through a relationship id, as
+# DrawingML blips or, in older documents, VML image data
+PICTURES = {
+    "{http://schemas.openxmlformats.org/drawingml/2006/main}blip": REL_NS + "embed",
+    "{urn:schemas-microsoft-com:vml}imagedata": REL_NS + "id"
+}
+
+
+def stream_text(stream, out: list, tables: list = None):
+    """
+    Appends the text of a WordprocessingML part to out, reproducing the
+    output of docx2txt (a blank line before every paragraph, tabs and
+    breaks kept inline) without ever holding the whole tree in memory.
+    If tables is given, every table is also appended to it as a list of
+    rows, each a list of its cells, each a dict of its stripped text and
+    the relationship ids of the pictures it embeds.
+    """
+    # the tables being read, innermost last, and where the text of the
+    # cells being read within them starts, with their pictures
+    open_tables = []
+    cells = []
+    for event, element in ET.iterparse(stream, events=("start", "end")):
+        tag = element.tag
+        if event == "start":
+            if tag == PARAGRAPH:
+                out.append("\n\n")
+            elif tag == TAB:
+                out.append("\t")
+            elif tag in BREAKS:
+                out.append("\n")
+            elif tables is not None:
+                if tag == TABLE:
+                    open_tables.append([])
+                elif tag == ROW and len(open_tables) > 0:
+                    open_tables[-1].append([])
+                elif tag == CELL and len(open_tables) > 0:
+                    cells.append((len(out), []))
+                elif tag in PICTURES and len(cells) > 0:
+                    cells[-1][1].append(element.get(PICTURES[tag]))
+        elif tag == TEXT:
+            if element.text is not None:
+                out.append(element.text)
+        elif tag == PARAGRAPH:
+            element.clear()
+        elif tables is not None:
+            if tag == CELL and len(cells) > 0 and len(open_tables[-1]) > 0:
+                start, pictures = cells.pop()
+                open_tables[-1][-1].append({"text": "".join(out[start:]).strip(), "images": pictures})
+            elif tag == TABLE and len(open_tables) > 0:
+                tables.append(open_tables.pop())
+
+
+def read_relationships(stream):
+    """
+    Returns the hyperlink targets of a relationships part, and the target
+    of each of its image relationships by id.
+    """
+    links = []
+    images = {}
+    for _, element in ET.iterparse(stream):
+        if element.tag == RELS_NS + "Relationship":
+            if element.get("Type") == HYPERLINK:
+                links.append(element.get("Target"))
+            elif element.get("Type") == IMAGE:
+                images[element.get("Id")] = element.get("Target")
+    return links, images
+
+
+def read_docx(path: str, store=None, trace=None, tables: bool = False, accept=None):
+    """
+    Opens the archive at path exactly once and returns its text (headers,
+    body and footers, in that order), the hyperlink targets of the main
+    document and its embedded images. Each image is streamed into store
+    if one is given, and the record it returns is listed in place of the
+    image's name. If a trace is given, the time spent on the text, the
+    hyperlinks and the images is recorded against it. If tables is True,
+    the cells of the main document's tables are returned as well, each
+    with its text and the names of the images it embeds.
+
+    If accept is given, the size of each image is first probed from the
+    header of its archive member, and only images for which
+    accept(width, height) holds are stored, their records carrying the
+    probed width and height. Rejected images are never written anywhere.
+    """
+    def stage(name):
+        return trace.stage(name) if trace is not None else nullcontext()
+
+    out = []
+    hyperlinks = []
+    targets = {}
+    images = []
+    found_tables = [] if tables else None
+    with ZipFile(path) as archive:
+        members = archive.namelist()
+        headers = [m for m in members if re.match(r"word/header[0-9]*\.xml", m)]
+        footers = [m for m in members if re.match(r"word/footer[0-9]*\.xml", m)]
+        with stage("docx_text"):
+            for member in headers + ["word/document.xml"] + footers:
+                with archive.open(member) as stream:
+                    stream_text(stream, out, found_tables if member == "word/document.xml" else None)
+        with stage("links"):
+            if "word/_rels/document.xml.rels" in members:
+                with archive.open("word/_rels/document.xml.rels") as stream:
+                    hyperlinks, targets = read_relationships(stream)
+        with stage("image_extraction"):
+            for member in members:
+                if os.path.splitext(member)[1] not in IMAGE_EXT:
+                    continue
+                name = os.path.basename(member)
+                if trace is not None:
+                    trace.count("images", archive.getinfo(member).file_size)
+                size = None
+                if accept is not None:
+                    with archive.open(member) as stream:
+                        size = probe_size(stream, partial(archive.open, member))
+                    if size is not None and not accept(*size):
+                        if trace is not None:
+                            trace.count("images_rejected", archive.getinfo(member).file_size)
+                        continue
+                if store is None:
+                    images.append(name)
+                    continue
+                with archive.open(member) as stream:
+                    image = store.put(name, stream)
+                if size is not None:
+                    image["width"], image["height"] = size
+                images.append(image)
+    if trace is not None:
+        trace.count("docx", os.path.getsize(path))
+        trace.count("text", sum(len(piece) for piece in out))
+    contents = {
+        "text": "".join(out).strip(),
+        "hyperlinks": hyperlinks,
+        "images": images
+    }
+    if tables:
+        for table in found_tables:
+            for row in table:
+                for cell in row:
+                    cell["images"] = [os.path.basename(targets[id]) for id in cell["images"] if id in targets]
+        contents["tables"] = found_tables
+    return contents
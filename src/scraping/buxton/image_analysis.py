@@ -0,0 +1,153 @@
+"""
+Content analysis of extracted images, for --analyze. Each image is decoded
+once, at a reduced scale where the format allows it, into a small RGB array,
+and a whole batch of them is then measured together with NumPy:
+
+- the dominant colours, the mean colour of the most common cells of a
+  4 x 4 x 4 colour cube, and the share of the image each covers
+- contrast, the largest standard deviation of a colour channel, which
+  tells blank spacers from pictures
+- entropy, in bits, of the image's spread over the cells of the cube
+- flatness, the share of neighbouring pixels with exactly the same grey
+  level, which together with few colours marks logos and other graphics
+- a 64 bit perceptual hash, the signs of the lowest 8 x 8 DCT coefficients
+  of the grey levels against their median
+- an aspect class, from the image's own width and height
+"""
+
+import numpy as np
+from PIL import Image
+
+SIDE = 32
+# below this an image is a blank spacer
+MIN_CONTRAST = 4.0
+# a graphic is flat almost everywhere and made of a handful of colours
+GRAPHIC_FLATNESS = 0.85
+GRAPHIC_COLOURS = 4
+COLOUR_SHARE = 0.02
+DOMINANT = 3
+
+GREY = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def dct_matrix(size: int):
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2 / size)
+    matrix[0] /= np.sqrt(2)
+    return matrix.astype(np.float32)
+
+
+DCT = dct_matrix(SIDE)
+
+
+def aspect_class(width: int, height: int):
+    ratio = width / height
+    if ratio < 0.5:
+        return "tall"
+    if ratio < 0.9:
+        return "portrait"
+    if ratio <= 1.1:
+        return "square"
+    if ratio <= 2:
+        return "landscape"
+    return "panorama"
+
+
+def decode(stream):
+    """
+    Decodes an image into a SIDE x SIDE RGB array. JPEGs are decoded
+    straight at a fraction of their size, which Pillow's draft mode allows.
+    """
+    with Image.open(stream) as image:
+        image.draft("RGB", (SIDE * 2, SIDE * 2))
+        if "A" in image.getbands() or image.mode == "P":
+            # transparent areas are shown on white
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+        return np.asarray(image.resize((SIDE, SIDE), Image.BILINEAR, reducing_gap=2.0), dtype=np.uint8)
+
+
+def measure(pixels):
+    """
+    Measures a batch of decoded images, an (n, SIDE, SIDE, 3) uint8 array,
+    returning one dict of features per image.
+    """
+    count = len(pixels)
+    if count == 0:
+        return []
+    rgb = pixels.astype(np.float32)
+    grey = rgb @ GREY
+    offsets = np.arange(count)
+
+    contrast = rgb.std(axis=(1, 2)).max(axis=1)
+
+    # every pixel's cell of the colour cube, numbered apart for each image
+    cells = (pixels // 64).astype(np.int64)
+    cell = ((cells[..., 0] * 16 + cells[..., 1] * 4 + cells[..., 2]) + 64 * offsets[:, None, None]).ravel()
+    shares = np.bincount(cell, minlength=64 * count).reshape(count, 64)
+    sums = np.stack([np.bincount(cell, rgb[..., channel].ravel(), minlength=64 * count)
+                     for channel in range(3)]).reshape(3, count, 64).transpose(1, 0, 2)
+    means = sums / np.maximum(shares, 1)[:, None, :]
+    shares = shares / (SIDE * SIDE)
+    logs = np.log2(np.where(shares > 0, shares, 1))
+    entropy = -(shares * logs).sum(axis=1)
+    dominant = np.argsort(-shares, axis=1, kind="stable")[:, :DOMINANT]
+    colours = (shares >= COLOUR_SHARE).sum(axis=1)
+
+    flatness = (np.diff(grey, axis=2) == 0).mean(axis=(1, 2))
+
+    coefficients = (DCT @ grey @ DCT.T)[:, :8, :8].reshape(count, 64)
+    bits = coefficients > np.median(coefficients[:, 1:], axis=1)[:, None]
+    hashes = np.packbits(bits, axis=1)
+
+    features = []
+    for i in range(count):
+        blank = bool(contrast[i] < MIN_CONTRAST)
+        features.append({
+            "contrast": round(float(contrast[i]), 2),
+            "entropy": round(abs(float(entropy[i])), 3),
+            "flatness": round(float(flatness[i]), 3),
+            "colours": ["#%02x%02x%02x" % tuple(int(round(value)) for value in means[i, :, c])
+                        for c in dominant[i] if shares[i, c] > 0],
+            "colour_shares": [round(float(shares[i, c]), 3) for c in dominant[i] if shares[i, c] > 0],
+            "hash": hashes[i].tobytes().hex(),
+            "blank": blank,
+            "graphic": bool(not blank and flatness[i] >= GRAPHIC_FLATNESS and colours[i] <= GRAPHIC_COLOURS)
+        })
+    return features
+
+
+def analyze_batch(opens, sizes):
+    """
+    Decodes every image, each with a callable in opens returning a fresh
+    stream of it, and measures them all at once. sizes are the images'
+    own (width, height), which give their aspect class. Images that cannot
+    be decoded get None.
+    """
+    decoded = []
+    indices = []
+    for i, open_image in enumerate(opens):
+        try:
+            with open_image() as stream:
+                decoded.append(decode(stream))
+            indices.append(i)
+        except (OSError, ValueError):
+            pass
+    results = [None] * len(opens)
+    if len(decoded) == 0:
+        return results
+    for i, features in zip(indices, measure(np.stack(decoded))):
+        width, height = sizes[i]
+        features["aspect"] = aspect_class(width, height)
+        features["aspect_ratio"] = round(width / height, 3)
+        results[i] = features
+    return results
+
+
+def is_picture(features):
+    return features is not None and not features["blank"] and not features["graphic"]
@@ -0,0 +1,100 @@
+import struct
+from PIL import Image
+
+# JPEG start of frame markers, which carry the image's dimensions; 0xc4
+# (huffman tables), 0xc8 (reserved) and 0xcc (arithmetic coding) share
+# the range without being frames
+SOF_MARKERS = {0xc0, 0xc1, 0xc2, 0xc3, 0xc5, 0xc6, 0xc7, 0xc9, 0xca, 0xcb, 0xcd, 0xce, 0xcf}
+# markers that stand alone, without a length
+STANDALONE = {0x01, 0xd0, 0xd1, 0xd2, 0xd3, 0xd4, 0xd5, 0xd6, 0xd7, 0xd8}
+
+
+def read_exactly(stream, size: int):
+    data = stream.read(size)
+    return data if len(data) == size else None
+
+
+def skip(stream, size: int):
+    while size > 0:
+        chunk = stream.read(min(size, 1 << 16))
+        if len(chunk) == 0:
+            return False
+        size -= len(chunk)
+    return True
+
+
+def jpeg_size(stream):
+    """
+    Walks the segments of a JPEG that follow its SOI marker up to the first
+    frame header, skipping the payload of every other segment unread.
+    """
+    while True:
+        byte = stream.read(1)
+        # markers may be padded with any number of 0xff bytes
+        while byte == b"\xff":
+            byte = stream.read(1)
+        if len(byte) == 0:
+            return None
+        marker = byte[0]
+        if marker in STANDALONE:
+            continue
+        if marker == 0xd9:
+            return None
+        length = read_exactly(stream, 2)
+        if length is None:
+            return None
+        length = struct.unpack(">H", length)[0]
+        if marker in SOF_MARKERS:
+            frame = read_exactly(stream, 5)
+            if frame is None:
+                return None
+            height, width = struct.unpack(">xHH", frame)
+            return width, height
+        if not skip(stream, length - 2):
+            return None
+        if stream.read(1) != b"\xff":
+            return None
+
+
+def header_size(stream):
+    head = read_exactly(stream, 2)
+    if head is None:
+        return None
+    if head == b"\xff\xd8":
+        if stream.read(1) != b"\xff":
+            return None
+        return jpeg_size(stream)
+    rest = stream.read(24)
+    head += rest
+    if head.startswith(b"\x89PNG\r\n\x1a\n") and len(head) >= 24 and head[12:16] == b"IHDR":
+        return struct.unpack(">II", head[16:24])
+    if head[:6] in (b"GIF87a", b"GIF89a") and len(head) >= 10:
+        return struct.unpack("<HH", head[6:10])
+    if head.startswith(b"BM") and len(head) >= 26:
+        header_length = struct.unpack("<I", head[14:18])[0]
+        if header_length == 12:
+            return struct.unpack("<HH", head[18:22])
+        width, height = struct.unpack("<ii", head[18:26])
+        # a negative height marks a top-down bitmap
+        return width, abs(height)
+    return None
+
+
+def probe_size(stream, fallback=None):
+    """
+    Returns the (width, height) of the image whose bytes stream yields,
+    reading only as far into it as the header that records them. Formats
+    the header walk does not know are measured by Pillow on a fresh stream
+    from fallback, if given; None is returned if the size cannot be read.
+    """
+    try:
+        size = header_size(stream)
+    except struct.error:
+        size = None
+    if size is not None or fallback is None:
+        return size
+    try:
+        with fallback() as fresh:
+            return Image.open(fresh).size
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,179 @@
+import os
+import hashlib
+import tempfile
+from variants import make_variants, variant_name, write_variants
+
+
+def stored_digest(file: str):
+    # payloads are named by their digest, and their variants add a suffix to it
+    return file.split(".")[0].split("_")[0]
+
+
+class ImageStore:
+    """
+    Stores image payloads by the sha256 of their bytes, so an image that
+    appears in several documents is kept on disk exactly once. Files live at
+    <root>/<first two hex digits>/<digest><ext> and are served from the same
+    relative path under base_url.
+    """
+
+    def __init__(self, root: str, base_url: str):
+        self.root = root
+        self.base_url = base_url.rstrip("/")
+
+    def put(self, name: str, stream):
+        """
+        Streams an image into the store, returning where it lives and
+        whether this call was the one that added it.
+        """
+        ext = os.path.splitext(name)[1].lower()
+        digest = hashlib.sha256()
+        size = 0
+        fd, temp = tempfile.mkstemp(dir=self.root, suffix=ext)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                for chunk in iter(lambda: stream.read(1 << 16), b""):
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+            digest = digest.hexdigest()
+            folder = digest[:2]
+            file = digest + ext
+            path = f"{self.root}/{folder}/{file}"
+            os.makedirs(f"{self.root}/{folder}", exist_ok=True)
+            try:
+                # linking fails if the payload is already stored, which makes
+                # the check safe across concurrently importing processes
+                os.link(temp, path)
+                new = True
+            except FileExistsError:
+                new = False
+        finally:
+            os.remove(temp)
+        return {
+            "name": name,
+            "digest": digest,
+            "folder": folder,
+            "file": file,
+            "path": path,
+            "url": f"{self.base_url}/{folder}/{file}",
+            "size": size,
+            "new": new
+        }
+
+    def open(self, image):
+        return open(image["path"], "rb")
+
+    def write_variants(self, image, width: int):
+        write_variants(image["path"], f"{self.root}/{image['folder']}", image["file"], width)
+
+    def sweep(self, keep):
+        """
+        Removes every payload whose digest is not in keep, with its
+        variants, returning how many files were removed.
+        """
+        removed = 0
+        for folder in os.listdir(self.root):
+            path = f"{self.root}/{folder}"
+            if not os.path.isdir(path):
+                continue
+            for file in os.listdir(path):
+                if stored_digest(file) not in keep:
+                    os.remove(f"{path}/{file}")
+                    removed += 1
+        return removed
+
+
+class GridFSImageStore:
+    """
+    Stores image payloads in a GridFS bucket, each uploaded once as its _o
+    variant, with its own name and the variants equal to it as aliases.
+    The Dash server does not serve GridFS, so base_url is where it is published.
+    """
+
+    def __init__(self, mongo_uri: str, database: str, bucket: str, base_url: str):
+        # gridfs comes with pymongo, which only the database importers need
+        from gridfs import GridFSBucket
+        from pymongo import MongoClient
+        self.db = MongoClient(mongo_uri)[database]
+        self.bucket = GridFSBucket(self.db, bucket)
+        self.files = self.db[f"{bucket}.files"]
+        self.base_url = base_url.rstrip("/")
+
+    def _upload(self, id: str, stream, metadata=None):
+        """
+        Uploads stream as id, returning False if the bucket already holds
+        it, including when another process uploads it at the same time.
+        """
+        from gridfs.errors import FileExists
+        from pymongo.errors import DuplicateKeyError
+        if self.files.find_one({"_id": id}, {"_id": 1}) is not None:
+            return False
+        try:
+            self.bucket.upload_from_stream_with_id(id, id, stream, metadata=metadata)
+        except (FileExists, DuplicateKeyError):
+            return False
+        return True
+
+    def _alias(self, path: str, name: str):
+        self.files.update_one({"_id": variant_name(path, "_o")}, {"$addToSet": {"aliases": name}})
+
+    def put(self, name: str, stream):
+        """
+        Streams an image into the bucket, returning where it lives and
+        whether this call was the one that added it. The stream has to be
+        seekable, as the archive members read_docx passes are.
+        """
+        ext = os.path.splitext(name)[1].lower()
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in iter(lambda: stream.read(1 << 16), b""):
+            digest.update(chunk)
+            size += len(chunk)
+        digest = digest.hexdigest()
+        folder = digest[:2]
+        file = digest + ext
+        path = f"{folder}/{file}"
+        stream.seek(0)
+        # the payload is the _o variant, and is also found by its own name
+        new = self._upload(variant_name(path, "_o"), stream, {"name": name, "sha256": digest})
+        self._alias(path, path)
+        return {
+            "name": name,
+            "digest": digest,
+            "folder": folder,
+            "file": file,
+            "path": path,
+            "url": f"{self.base_url}/{path}",
+            "size": size,
+            "new": new
+        }
+
+    def open(self, image):
+        return self.bucket.open_download_stream(variant_name(image["path"], "_o"))
+
+    def write_variants(self, image, width: int):
+        def target(suffix):
+            return f"{image['folder']}/{variant_name(image['file'], suffix)}"
+
+        def link(suffix):
+            if suffix != "_o":
+                self._alias(image["path"], target(suffix))
+
+        def save(suffix, resized, format, **options):
+            with self.bucket.open_upload_stream_with_id(target(suffix), target(suffix)) as out:
+                resized.save(out, format, **options)
+
+        make_variants(lambda: self.open(image), width, link, save)
+
+    def sweep(self, keep):
+        """
+        Deletes every payload whose digest is not in keep, with its
+        variants, returning how many files were deleted.
+        """
+        removed = 0
+        for stored in self.files.find({}, {"_id": 1}):
+            if stored_digest(stored["_id"].rsplit("/", 1)[-1]) not in keep:
+                self.bucket.delete(stored["_id"])
+                removed += 1
+        return removed
@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import heapq
+import marshal
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+
+
+class Trace:
+    """
+    Collects the time spent in, and bytes handled by, each stage of
+    importing one source file. Traces are plain data once finished, so
+    they can be sent back from a worker process with the parse result.
+    """
+
+    def __init__(self, name: str, memory: bool = False, profile: bool = False):
+        self.name = name
+        self.memory = memory
+        self.stages = {}
+        self.bytes = {}
+        self.peak_memory = None
+        self.profile = None
+        self.profiler = cProfile.Profile() if profile else None
+        self.started = time.perf_counter()
+        self.elapsed = 0
+        if memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        if self.profiler is not None:
+            self.profiler.enable()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0) + time.perf_counter() - start
+
+    def count(self, name: str, amount: int):
+        self.bytes[name] = self.bytes.get(name, 0) + amount
+
+    def finish(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.create_stats()
+            # the same format cProfile writes with dump_stats
+            self.profile = marshal.dumps(self.profiler.stats)
+            self.profiler = None
+        if self.memory:
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+        self.elapsed = time.perf_counter() - self.started
+        return self
+
+    def to_dict(self):
+        record = {
+            "file": self.name,
+            "seconds": self.elapsed,
+            "stages": self.stages,
+            "bytes": self.bytes
+        }
+        if self.peak_memory is not None:
+            record["peak_memory"] = self.peak_memory
+        return record
+
+
+class Recorder:
+    """
+    Writes one JSON line per finished trace, accumulates per-stage totals
+    and keeps the profiles of the slowest files so that they can be dumped
+    as .prof files at the end of the import.
+    """
+
+    def __init__(self, path: str = None, profile_dir: str = None, slowest: int = 0):
+        self.out = open(path, "w", encoding="utf-8") if path is not None else None
+        self.profile_dir = profile_dir
+        self.slowest = slowest
+        self.profiles = []
+        self.files = 0
+        self.seconds = 0
+        self.stages = {}
+        self.bytes = {}
+        self.peak_memory = 0
+
+    def record(self, trace: Trace, **extra):
+        record = trace.to_dict()
+        record.update(extra)
+        if self.out is not None:
+            self.out.write(json.dumps(record) + "\n")
+            self.out.flush()
+        self.files += 1
+        self.seconds += trace.elapsed
+        for stage, seconds in trace.stages.items():
+            total = self.stages.setdefault(stage, {"seconds": 0, "max": 0, "count": 0})
+            total["seconds"] += seconds
+            total["max"] = max(total["max"], seconds)
+            total["count"] += 1
+        for name, amount in trace.bytes.items():
+            self.bytes[name] = self.bytes.get(name, 0) + amount
+        if trace.peak_memory is not None:
+            self.peak_memory = max(self.peak_memory, trace.peak_memory)
+        if trace.profile is not None and self.slowest > 0:
+            entry = (trace.elapsed, trace.name, trace.profile)
+            if len(self.profiles) < self.slowest:
+                heapq.heappush(self.profiles, entry)
+            else:
+                heapq.heappushpop(self.profiles, entry)
+
+    def aggregate(self):
+        stages = {}
+        for stage, total in self.stages.items():
+            stages[stage] = {
+                "seconds": total["seconds"],
+                "mean": total["seconds"] / total["count"],
+                "max": total["max"]
+            }
+        aggregate = {
+            "files": self.files,
+            "seconds": self.seconds,
+            "stages": stages,
+            "bytes": self.bytes
+        }
+        if self.peak_memory > 0:
+            aggregate["peak_memory"] = self.peak_memory
+        return aggregate
+
+    def close(self):
+        aggregate = self.aggregate()
+        if self.out is not None:
+            self.out.write(json.dumps({"aggregate": aggregate}) + "\n")
+            self.out.close()
+            self.out = None
+        if self.profile_dir is not None and len(self.profiles) > 0:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            for elapsed, name, profile in self.profiles:
+                with open(f"{self.profile_dir}/{name}.prof", "wb") as f:
+                    f.write(profile)
+        return aggregate
@@ -0,0 +1,45 @@
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_text(content: str):
+    # the same caption typed twice differs at most in its whitespace
+    return " ".join(unicodedata.normalize("NFC", content).split())
+
+
+class InternCache:
+    """
+    A least recently used map of at most capacity entries that counts its
+    hits, misses and evictions. The importers key it on normalized text to
+    find the documents already written for that text during this import.
+    """
+
+    def __init__(self, capacity: int = 10000):
+        self.capacity = max(1, capacity)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def report(self):
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return "no lookups"
+        return (f"{self.hits} of {lookups} lookups hit ({self.hits / lookups:.1%}), "
+                f"{len(self.entries)} entries held, {self.evictions} evicted")
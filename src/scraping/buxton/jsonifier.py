@@ -1,37 +1,28 @@
 import os
-import docx2txt
-from docx import Document
-from docx.opc.constants import RELATIONSHIP_TYPE as RT
-import re
-import shutil
 import uuid
 import json
-import base64
-from shutil import copyfile
 from PIL import Image
+import argparse
+from buxton_parser import parse_device
+from docx_reader import read_docx
+from image_store import ImageStore, stored_digest
+from jsonl import JsonlWriter
+from parallel import is_candidate, parse_all
+from variants import write_all_variants
+from functools import partial
+from contextlib import nullcontext
 
 files_path = "../../server/public/files"
 source_path = "./source"
-temp_images_path = "./extracted_images"
-server_images_path = f"{files_path}/images/buxton"
+# kept apart from the importers' store, whose sweep only keeps what the
+# database refers to
+server_images_path = f"{files_path}/images/buxton_json"
+server_images_url = "http://localhost:1050/files/images/buxton_json"
 json_path = "./json"
 
 
-# noinspection PyProtectedMember
-def extract_links(file):
-    links = []
-    doc = Document(file)
-    rels = doc.part.rels
-    for rel in rels:
-        item = rels[rel]
-        if item.reltype == RT.HYPERLINK and ".aspx" not in item._target:
-            links.append(item._target)
-    return links
-
-
-def extract_value(kv_string):
-    pieces = kv_string.split(":")
-    return (pieces[1] if len(pieces) > 1 else kv_string).strip()
+def extract_links(targets):
+    return [target for target in targets if ".aspx" not in target]
 
 
 def mkdir_if_absent(path):
@@ -39,193 +30,147 @@ def mkdir_if_absent(path):
         if not os.path.exists(path):
             os.mkdir(path)
     except OSError:
-        print("failed to create the appropriate directory structures for %s" % file_name)
+        print("failed to create the appropriate directory structures for %s" % path)
 
 
 def guid():
     return str(uuid.uuid4())
 
 
-def encode_image(folder: str, name: str):
-    with open(f"{temp_images_path}/{folder}/{name}", "rb") as image:
-        encoded = base64.b64encode(image.read())
-        return encoded.decode("utf-8")
+def configure(source_dir: str, files_dir: str):
+    global source_path, files_path, server_images_path
+    source_path = source_dir
+    files_path = files_dir
+    server_images_path = f"{files_path}/images/buxton_json"
+
+
+def is_photo(width: int, height: int):
+    return abs(width - height) >= 10
 
 
-def parse_document(name: str):
+def parse_document(name: str, variant_threads: int = 4):
     print(f"parsing {name}...")
-    pure_name = name.split(".")[0]
 
     result = {}
 
-    saved_device_images_dir = server_images_path + "/" + pure_name
-    temp_device_images_dir = temp_images_path + "/" + pure_name
-    mkdir_if_absent(temp_device_images_dir)
-    mkdir_if_absent(saved_device_images_dir)
-
-    raw = str(docx2txt.process(source_path +
-                               "/" + name, temp_device_images_dir))
+    store = ImageStore(server_images_path, server_images_url)
+    contents = read_docx(source_path + "/" + name, store, accept=is_photo)
+    raw = contents["text"]
 
     extracted_images = []
-    for image in os.listdir(temp_device_images_dir):
-        temp = f"{temp_device_images_dir}/{image}"
-        native_width, native_height = Image.open(temp).size
-        if abs(native_width - native_height) < 10:
+    variant_jobs = []
+    for image in contents["images"]:
+        native_width, native_height = image.get("width"), image.get("height")
+        if native_width is None:
+            native_width, native_height = Image.open(image["path"]).size
+        if not is_photo(native_width, native_height):
             continue
-        original = saved_device_images_dir + "/" + image.replace(".", "_o.", 1)
-        medium = saved_device_images_dir + "/" + image.replace(".", "_m.", 1)
-        copyfile(temp, original)
-        copyfile(temp, medium)
-        server_path = f"http://localhost:1050/files/images/buxton/{pure_name}/{image}"
-        extracted_images.append(server_path)
+        if image["new"]:
+            variant_jobs.append((image["path"], f"{server_images_path}/{image['folder']}", image["file"], native_width))
+        extracted_images.append(image["url"])
+    write_all_variants(variant_jobs, variant_threads)
     result["extracted_images"] = extracted_images
 
-    def sanitize(line): return re.sub("[\n\t]+", "", line).replace(u"\u00A0", " ").replace(
-        u"\u2013", "-").replace(u"\u201c", '''"''').replace(u"\u201d", '''"''').strip()
-
-    def sanitize_price(raw_price: str):
-        raw_price = raw_price.replace(",", "")
-        start = raw_price.find("$")
-        if "x" in raw_price.lower():
-            return None
-        if start > -1:
-            i = start + 1
-            while i < len(raw_price) and re.match(r"[0-9.]", raw_price[i]):
-                i += 1
-            price = raw_price[start + 1: i + 1]
-            return float(price)
-        elif raw_price.lower().find("nfs"):
-            return -1
-        else:
-            return None
-
-    def remove_empty(line): return len(line) > 1
-
-    def try_parse(to_parse: int):
-        try:
-            value = int(to_parse)
-            return value
-        except ValueError:
-            value = None
-            return value
-
-    lines = list(map(sanitize, raw.split("\n")))
-    lines = list(filter(remove_empty, lines))
-
-    result["title"] = lines[2].strip()
-    result["short_description"] = lines[3].strip().replace(
-        "Short Description: ", "")
-
-    cur = 5
-    notes = ""
-    while lines[cur] != "Device Details":
-        notes += lines[cur] + " "
-        cur += 1
-    result["buxton_notes"] = notes.strip()
-
-    cur += 1
-    clean = list(
-        map(lambda data: data.strip().split(":"), lines[cur].split("|")))
-    result["company"] = clean[0][len(clean[0]) - 1].strip()
-
-    result["year"] = try_parse(clean[1][len(clean[1]) - 1].strip())
-    result["original_price"] = sanitize_price(
-        clean[2][len(clean[2]) - 1].strip())
-
-    cur += 1
-
-    result["degrees_of_freedom"] = try_parse(extract_value(
-        lines[cur]).replace("NA", "N/A"))
-    cur += 1
-
-    dimensions = lines[cur].lower()
-    if dimensions.startswith("dimensions"):
-        dim_concat = dimensions[11:].strip()
-        cur += 1
-        while lines[cur] != "Key Words":
-            dim_concat += (" " + lines[cur].strip())
-            cur += 1
-        result["dimensions"] = dim_concat
-    else:
-        result["dimensions"] = "N/A"
-
-    cur += 1
-    result["primary_key"] = extract_value(lines[cur])
-    cur += 1
-    result["secondary_key"] = extract_value(lines[cur])
-
-    while lines[cur] != "Links":
-        result["secondary_key"] += (" " + extract_value(lines[cur]).strip())
-        cur += 1
-
-    cur += 1
+    record = parse_device(raw)
+
+    result["title"] = record.title
+    result["short_description"] = record.short_description
+    result["buxton_notes"] = record.buxton_notes
+    result["company"] = record.company
+    result["year"] = record.year
+    result["original_price"] = record.original_price
+    result["degrees_of_freedom"] = record.degrees_of_freedom
+    result["dimensions"] = record.dimensions
+    result["primary_key"] = record.primary_key
+    result["secondary_key"] = record.secondary_key
+
     link_descriptions = []
-    while lines[cur] != "Image":
-        description = lines[cur].strip().lower()
-        valid = True
-        for ignored in ["powerpoint", "vimeo", "xxx"]:
-            if ignored in description:
-                valid = False
-                break
-        if valid:
+    for description in record.link_descriptions:
+        description = description.lower()
+        if not any(ignored in description for ignored in ["powerpoint", "vimeo", "xxx"]):
             link_descriptions.append(description)
-        cur += 1
     result["link_descriptions"] = link_descriptions
 
-    result["hyperlinks"] = extract_links(source_path + "/" + name)
+    result["hyperlinks"] = extract_links(contents["hyperlinks"])
 
     images = []
     captions = []
-    cur += 3
-    while cur + 1 < len(lines) and lines[cur] != "NOTES:":
-        name = lines[cur]
-        if "full document" not in name.lower():
-            images.append(name)
-            captions.append(lines[cur + 1])
-        cur += 2
+    for image, caption in zip(record.table_image_names, record.captions):
+        if "full document" not in image.lower():
+            images.append(image)
+            captions.append(caption)
     result["table_image_names"] = images
-
     result["captions"] = captions
 
-    notes = []
-    if cur < len(lines) and lines[cur] == "NOTES:":
-        cur += 1
-        while cur < len(lines):
-            notes.append(lines[cur])
-            cur += 1
-    if len(notes) > 0:
-        result["notes"] = notes
+    if len(record.notes) > 0:
+        result["notes"] = record.notes
 
     return result
 
 
-if os.path.exists(server_images_path):
-    shutil.rmtree(server_images_path)
-while os.path.exists(server_images_path):
-    pass
-os.mkdir(server_images_path)
-
-mkdir_if_absent(source_path)
-mkdir_if_absent(json_path)
-mkdir_if_absent(temp_images_path)
-
-results = []
-
-candidates = 0
-for file_name in os.listdir(source_path):
-    if file_name.endswith('.docx') or file_name.endswith(".doc"):
-        candidates += 1
-        results.append(parse_document(file_name))
-
-
-with open(f"./json/buxton_collection.json", "w", encoding="utf-8") as out:
-    json.dump(results, out, ensure_ascii=False, indent=4)
-
-print(f"\nSuccessfully parsed {candidates} candidates.")
-
-print("\nrewriting .gitignore...")
-entries = ['*', '!.gitignore']
-with open(files_path + "/.gitignore", 'w') as f:
-    f.write('\n'.join(entries))
-
-shutil.rmtree(temp_images_path)
+def main(argv=None):
+    global json_path
+
+    parser = argparse.ArgumentParser(description="Convert Buxton device documents to JSON")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes used to parse documents")
+    parser.add_argument("--variant-threads", type=int, default=4,
+                        help="number of images resized at once within each process")
+    parser.add_argument("--jsonl", action="store_true",
+                        help="stream one record per device to buxton_collection.jsonl as it is parsed")
+    parser.add_argument("--source", default=source_path,
+                        help="folder containing the device documents")
+    parser.add_argument("--files-path", default=files_path,
+                        help="the server's public files folder, where images are written")
+    parser.add_argument("--json-path", default=json_path,
+                        help="folder the collection is written to")
+    args = parser.parse_args(argv)
+    configure(args.source, args.files_path)
+    json_path = args.json_path
+
+    os.makedirs(server_images_path, exist_ok=True)
+
+    mkdir_if_absent(source_path)
+    mkdir_if_absent(json_path)
+
+    results = []
+    referenced = set()
+
+    candidates = sorted(filter(is_candidate, os.listdir(source_path)))
+    failures = 0
+    parsed_count = 0
+    with JsonlWriter(f"{json_path}/buxton_collection.jsonl") if args.jsonl else nullcontext() as stream:
+        for file_name, parsed, error in parse_all(
+                partial(parse_document, variant_threads=args.variant_threads), candidates, args.workers,
+                configure, (args.source, args.files_path)):
+            if error is not None:
+                failures += 1
+                print(f"failed to parse {file_name}, skipping...\n{error}")
+                continue
+            parsed_count += 1
+            referenced.update(stored_digest(url.rsplit("/", 1)[-1]) for url in parsed["extracted_images"])
+            if stream is not None:
+                stream.write(parsed)
+            else:
+                results.append(parsed)
+
+    if stream is None:
+        with open(f"{json_path}/buxton_collection.json", "w", encoding="utf-8") as out:
+            json.dump(results, out, ensure_ascii=False, indent=4)
+
+    # images are only ever added while parsing, so what the collection
+    # just written no longer refers to is removed afterwards
+    removed = ImageStore(server_images_path, server_images_url).sweep(referenced)
+    if removed > 0:
+        print(f"removed {removed} stored image files the collection no longer refers to")
+
+    print(f"\nSuccessfully parsed {parsed_count} of {len(candidates)} candidates, {failures} failed.")
+
+    print("\nrewriting .gitignore...")
+    entries = ['*', '!.gitignore']
+    with open(files_path + "/.gitignore", 'w') as f:
+        f.write('\n'.join(entries))
+
+
+if __name__ == "__main__":
+    main()
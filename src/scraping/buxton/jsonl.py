@@ -0,0 +1,54 @@
+import os
+import json
+
+
+class JsonlWriter:
+    """
+    Appends one compact JSON record per line to a partial file next to
+    path, flushing after every record so that a crash keeps everything
+    written so far. The partial file only replaces path on finalize, so
+    readers never see a half written collection under the final name.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.partial = path + ".partial"
+        self.out = open(self.partial, "w", encoding="utf-8")
+        self.count = 0
+
+    def write(self, record):
+        self.out.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+        self.out.write("\n")
+        self.out.flush()
+        self.count += 1
+
+    def finalize(self):
+        self.out.flush()
+        os.fsync(self.out.fileno())
+        self.out.close()
+        os.replace(self.partial, self.path)
+
+    def close(self):
+        if not self.out.closed:
+            self.out.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.finalize()
+        else:
+            # leave the partial file behind so the records parsed
+            # before the failure can still be inspected or recovered
+            self.close()
+
+
+def read_records(path: str):
+    """
+    Lazily yields the records of a JSONL file one line at a time.
+    """
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
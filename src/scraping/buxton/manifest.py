@@ -0,0 +1,122 @@
+import os
+import json
+import hashlib
+
+# fields that legitimately differ between two imports of the same content
+VOLATILE_FIELDS = ["creationDate"]
+
+
+def file_digest(path: str):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_hash(document):
+    fields = {key: value for key, value in document["fields"].items() if key not in VOLATILE_FIELDS}
+    stable = json.dumps([document["_id"], document["__type"], fields], sort_keys=True, default=str)
+    return hashlib.sha1(stable.encode("utf-8")).hexdigest()
+
+
+class Manifest:
+    """
+    Remembers, for every source file, the digest of the .docx that was last
+    imported, the layout document it produced and the content hash of every
+    document written on its behalf. This lets an incremental import skip
+    unchanged files, skip unchanged documents and remove documents that a
+    changed or deleted file no longer produces.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.files = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.files = json.load(f)["files"]
+        self.current = None
+        self.documents = None
+
+    def unchanged(self, file_name: str, digest: str):
+        entry = self.files.get(file_name)
+        return entry is not None and entry["digest"] == digest
+
+    def layout(self, file_name: str):
+        entry = self.files.get(file_name)
+        return entry["layout"] if entry is not None else None
+
+    def begin(self, file_name: str):
+        self.current = file_name
+        self.documents = {}
+
+    def changed(self, document):
+        """
+        Records document as produced by the file being written and
+        returns whether it differs from what the last import wrote.
+        """
+        digest = content_hash(document)
+        self.record(document["_id"], digest)
+        previous = self.files.get(self.current, {}).get("documents", {})
+        return previous.get(document["_id"]) != digest
+
+    def record(self, id: str, digest: str):
+        """
+        Records a document another file already wrote, with the content
+        hash it was written with, as produced by the file being written.
+        """
+        self.documents[id] = digest
+
+    def end(self, digest: str, layout: str):
+        """
+        Closes the entry for the file being written and returns the ids
+        of the documents the previous import wrote for it but this one did
+        not, and which no other file still shares.
+        """
+        previous = self.files.get(self.current, {}).get("documents", {})
+        stale = [id for id in previous if id not in self.documents]
+        stale = self.unshared(stale, self.current)
+        self.files[self.current] = {
+            "digest": digest,
+            "layout": layout,
+            "documents": self.documents
+        }
+        self.current = None
+        self.documents = None
+        return stale
+
+    def abandon(self):
+        """
+        Closes the entry for the file being written when building its
+        documents failed part way. The file keeps the layout it had, the
+        documents already written for it are recorded next to the ones it
+        had, so that a later import removes whichever it no longer produces,
+        and its digest is dropped, so that it is tried again.
+        """
+        entry = self.files.get(self.current, {"layout": None, "documents": {}})
+        self.files[self.current] = {
+            "digest": None,
+            "layout": entry["layout"],
+            "documents": {**entry["documents"], **self.documents}
+        }
+        self.current = None
+        self.documents = None
+
+    def forget(self, file_name: str):
+        entry = self.files.pop(file_name, None)
+        return self.unshared(list(entry["documents"]), file_name) if entry is not None else []
+
+    def unshared(self, ids, file_name: str):
+        if len(ids) == 0:
+            return ids
+        shared = set()
+        for other, entry in self.files.items():
+            if other != file_name:
+                shared.update(entry["documents"])
+        return [id for id in ids if id not in shared]
+
+    def save(self):
+        temp = self.path + ".tmp"
+        with open(temp, "w", encoding="utf-8") as f:
+            json.dump({"files": self.files}, f)
+        os.replace(temp, self.path)
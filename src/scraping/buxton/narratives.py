@@ -1,38 +1,283 @@
-from docx import Document
-import tempfile
-from zipfile import ZipFile
-import shutil
-from pathlib import Path
-from os import mkdir
-
-path = "./narratives/Theme - Chord Kbds.docx"
-doc = Document(path)
-
-# IMAGE_EXT = ('png', 'jpeg', 'jpg')
-#
-# with tempfile.TemporaryDirectory() as working_dir:
-#     with ZipFile(path) as working_zip:
-#         image_list = [name for name in working_zip.namelist() if any(name.endswith(ext) for ext in IMAGE_EXT)]
-#         working_zip.extractall(working_dir, image_list)
-#         mkdir("./test")
-#         for image in image_list:
-#             shutil.copy(Path(working_dir).resolve() / image, "./test")
-
-paragraphs = doc.paragraphs
-for i in range(len(paragraphs)):
-    print(f"{i}: {paragraphs[i].text}")
-
-# for section in doc.sections:
-#     print(section.orientation)
-
-# for shape in doc.inline_shapes:
-#     print(shape._inline)
-
-# images = doc.tables[0]
-# for row in images.rows:
-#     contents = []
-#     for cell in row.cells:
-#         contents.append(cell.text)
-    # print(contents)
+import os
+import re
+import hashlib
+import argparse
+import traceback
+from functools import partial
+from pymongo import MongoClient
+import scraper
+from scraper import Session, guid, protofy, listify, store, remove, text_doc_map, write_image, write_collection
+from bulk_writer import BulkWriter
+from dash_model import Doc
+from docx_reader import read_docx
+from instrument import Trace, Recorder
+from manifest import Manifest, file_digest
+from parallel import is_candidate, parse_all
 
+source = "./narratives"
+narratives_title = "Buxton Narratives"
 
+# narratives share the device import's manifest, under keys the device
+# import leaves alone, so that neither removes documents the other uses
+MANIFEST_KEY = "<narrative> "
+
+
+def configure(source_dir: str, files_dir: str, memory: bool = False, profile: bool = False,
+              images_url: str = None, gridfs=None, analyze: bool = False):
+    global source
+    source = source_dir
+    scraper.configure(scraper.source, files_dir, memory, profile, images_url, gridfs, analyze)
+
+
+def cell_lines(cell):
+    return [line.strip() for line in cell["text"].split("\n") if len(line.strip()) > 0]
+
+
+def image_captions(tables, names):
+    """
+    Reads the caption of every image from the first table row that shows
+    it, or gives its file name, taking the last other non-empty cell of
+    that row as the caption, or else the text under a picture in its own
+    cell.
+    """
+    captions = {}
+    for table in tables:
+        for row in table:
+            for i, cell in enumerate(row):
+                others = [" ".join(cell_lines(other)) for j, other in enumerate(row)
+                          if j != i and len(other["text"]) > 0]
+                for name in cell["images"] + [cell["text"]]:
+                    if name in names and name not in captions:
+                        if len(others) > 0:
+                            captions[name] = others[-1]
+                        else:
+                            captions[name] = " ".join(cell_lines(cell)) if name in cell["images"] else ""
+    return captions
+
+
+def parse_narrative(file_name: str, variant_threads: int = 4):
+    """
+    Reads a narrative document without touching the database: its title
+    (the first paragraph), the paragraphs outside its tables, and its
+    images with the captions given for them in its tables. Only the image
+    members of the archive are read, and only those that are not icons are
+    written, straight into the image store.
+    """
+    print(f"parsing {file_name}...")
+    trace = Trace(file_name, scraper.trace_memory, scraper.profile_files)
+
+    contents = read_docx(source + "/" + file_name, scraper.image_store(), trace, tables=True,
+                         accept=scraper.accepts_size)
+    images = scraper.extract_images(contents["images"], variant_threads, trace)
+
+    with trace.stage("parse"):
+        tables = contents["tables"]
+        table_text = {line for table in tables for row in table for cell in row for line in cell_lines(cell)}
+        lines = [line.strip() for line in contents["text"].split("\n")]
+        paragraphs = [line for line in lines if len(line) > 0 and line not in table_text]
+        if len(paragraphs) == 0:
+            raise ValueError(f"{file_name} has no text outside its tables")
+        captions = image_captions(tables, {image["name"] for image in images})
+
+    return {
+        "file_name": file_name,
+        "title": paragraphs[0],
+        "paragraphs": paragraphs[1:],
+        "images": images,
+        "captions": [captions.get(image["name"], "") for image in images],
+        "hyperlinks": scraper.extract_links(contents["hyperlinks"]),
+        "trace": trace.finish()
+    }
+
+
+def load_devices(collection):
+    """
+    Maps the lowercased title of every imported device to the id of its
+    schema document, the one the device's collection shows.
+    """
+    devices = {}
+    for document in collection.find({"fields.file_name": {"$exists": True}},
+                                    {"fields.title": 1, "fields.file_name": 1}):
+        title = document["fields"].get("title")
+        if title:
+            devices[title.lower()] = document["_id"]
+    return devices
+
+
+def device_pattern(devices):
+    if len(devices) == 0:
+        return None
+    # longest first, so that a title containing another is preferred
+    titles = sorted(devices, key=len, reverse=True)
+    return re.compile(r"(?<!\w)(" + "|".join(map(re.escape, titles)) + r")(?!\w)")
+
+
+def mentioned_devices(parsed, pattern, devices):
+    if pattern is None:
+        return []
+    found = []
+    for text in [parsed["title"]] + parsed["paragraphs"] + parsed["captions"]:
+        for match in pattern.finditer(text.lower()):
+            device = devices[match.group(1)]
+            if device not in found:
+                found.append(device)
+    return found
+
+
+def write_device_link(session: Session, file_name, device_id):
+    view_doc_guid = guid(file_name, device_id, "view")
+    store(session, scraper.CHILD_VIEW.doc(view_doc_guid, protofy(device_id)))
+    return view_doc_guid
+
+
+def write_narrative(session: Session, parsed, pattern, devices):
+    file_name = parsed["file_name"]
+    # paragraphs are laid out in the narrative's collection, so their views are its own
+    paragraphs = text_doc_map(session, parsed["paragraphs"], file_name, "paragraphs", share_views=False)
+    paragraph_guids = [proxy.field_id for proxy in paragraphs.items]
+
+    urls = []
+    image_guids = []
+    for image in parsed["images"]:
+        created = write_image(session, file_name, image)
+        urls.append(created["url"])
+        image_guids.append(created["layout_id"])
+
+    device_ids = mentioned_devices(parsed, pattern, devices)
+    device_guids = [write_device_link(session, file_name, device_id) for device_id in device_ids]
+
+    # images no table row names have no caption to write
+    captions = [caption for caption in parsed["captions"] if len(caption) > 0]
+    results = {
+        "schema": Doc(guid(file_name, "narrative"), {
+            "title": parsed["title"],
+            "narrative_file": file_name,
+            "paragraphs": paragraphs,
+            "captions": text_doc_map(session, captions, file_name, "captions"),
+            "hyperlinks": text_doc_map(session, parsed["hyperlinks"], file_name, "hyperlinks"),
+            "devices": listify(scraper.proxify_guids(device_ids))
+        }),
+        "child_guids": paragraph_guids + image_guids + device_guids
+    }
+    if len(urls) > 0:
+        results["image_urls"] = urls
+    return write_collection(session, results, ["title", "data"], "data", 5)
+
+
+def devices_digest(devices):
+    return hashlib.sha1(repr(sorted(devices.items())).encode("utf-8")).hexdigest()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import Buxton narrative documents into Dash, "
+                                                 "linked to the devices the device import wrote")
+    parser.add_argument("--batch-size", type=int, default=1000,
+                        help="maximum number of operations sent per bulk write")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes used to parse documents")
+    parser.add_argument("--variant-threads", type=int, default=4,
+                        help="number of images resized at once within each process")
+    parser.add_argument("--incremental", action="store_true",
+                        help="skip unchanged narratives and only write documents whose content changed")
+    parser.add_argument("--source", default=source,
+                        help="folder containing the narrative documents")
+    parser.add_argument("--files-path", default=scraper.filesPath,
+                        help="the server's public files folder, where images are written")
+    parser.add_argument("--manifest", default=scraper.manifest_path,
+                        help="the manifest shared with the device import")
+    scraper.add_image_arguments(parser)
+    parser.add_argument("--trace",
+                        help="write per-file and aggregate stage timings to this file as JSON lines")
+    parser.add_argument("--mongo-uri", default=scraper.mongo_uri)
+    parser.add_argument("--database", default=scraper.database)
+    args = parser.parse_args(argv)
+    gridfs = scraper.gridfs_bucket(parser, args)
+    settings = (args.source, args.files_path, False, False, args.image_url, gridfs, args.analyze)
+    configure(*settings)
+    recorder = Recorder(args.trace)
+
+    db = MongoClient(args.mongo_uri)[args.database]
+    manifest = Manifest(args.manifest)
+    session = Session(manifest, args.incremental)
+    session.collection = db.documents
+    session.writer = writer = BulkWriter(db.documents, args.batch_size)
+    if gridfs is None:
+        os.makedirs(scraper.image_dist, exist_ok=True)
+    scraper.mkdir_if_absent(source)
+
+    devices = load_devices(db.documents)
+    pattern = device_pattern(devices)
+    print(f"{len(devices)} imported devices to link narratives to")
+    scraper.begin_import(session)
+
+    # a narrative has to be relinked if the devices it could mention change
+    linked = devices_digest(devices)
+    candidates = sorted(filter(is_candidate, os.listdir(source)))
+    digests = {name: file_digest(source + "/" + name) + "/" + linked for name in candidates}
+    layouts = {}
+    to_parse = []
+    for file_name in candidates:
+        if args.incremental and manifest.unchanged(MANIFEST_KEY + file_name, digests[file_name]):
+            layouts[file_name] = manifest.layout(MANIFEST_KEY + file_name)
+        else:
+            to_parse.append(file_name)
+    print(f"{len(candidates) - len(to_parse)} unchanged narratives skipped")
+
+    failures = 0
+    for file_name, parsed, error in parse_all(
+            partial(parse_narrative, variant_threads=args.variant_threads), to_parse, args.workers,
+            configure, settings):
+        if error is not None:
+            failures += 1
+            print(f"failed to parse {file_name}, skipping...\n{error}")
+            layouts[file_name] = manifest.layout(MANIFEST_KEY + file_name)
+            continue
+        trace = parsed["trace"]
+        manifest.begin(MANIFEST_KEY + file_name)
+        try:
+            with trace.stage("build_documents"):
+                layout = write_narrative(session, parsed, pattern, devices)
+        except Exception:
+            failures += 1
+            print(f"failed to build the documents of {file_name}, skipping...\n{traceback.format_exc()}")
+            manifest.abandon()
+            layouts[file_name] = manifest.layout(MANIFEST_KEY + file_name)
+            continue
+        remove(session, manifest.end(digests[file_name], layout))
+        layouts[file_name] = layout
+        batches = len(writer.latencies)
+        with trace.stage("mongo_write"):
+            writer.flush()
+        scraper.record_trace(session, recorder, trace, batches)
+
+    for key in list(manifest.files):
+        if key.startswith(MANIFEST_KEY) and key[len(MANIFEST_KEY):] not in digests:
+            print(f"removing documents of deleted narrative {key[len(MANIFEST_KEY):]}...")
+            remove(session, manifest.forget(key))
+
+    print("writing narratives collection...")
+    manifest.begin("<narratives>")
+    parent_guid = write_collection(session, {
+        "schema": Doc(guid("narratives"), {"title": narratives_title}),
+        "child_guids": [layouts[name] for name in candidates if layouts[name] is not None]
+    }, ["title"], "data", 4)
+    remove(session, manifest.end(None, parent_guid))
+
+    print("appending narratives to main workspace...\n")
+    writer.update_one(
+        {"fields.title": scraper.target_doc_title},
+        {"$addToSet": {"fields.data.fields": {"fieldId": parent_guid, "__type": "proxy"}}}
+    )
+    print(f"database writes: {writer.report()}")
+    print(f"shared text documents: {session.text_cache.report()}")
+    manifest.save()
+    scraper.sweep_images(db.documents)
+    recorder.close()
+
+    suffix = "" if len(candidates) == 1 else "s"
+    print(f"import complete. {len(candidates)} narrative{suffix} processed, {failures} failed.")
+    return session
+
+
+if __name__ == "__main__":
+    main()
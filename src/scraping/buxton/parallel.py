@@ -0,0 +1,52 @@
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+
+def is_candidate(file_name: str):
+    return file_name.endswith(".docx") or file_name.endswith(".doc")
+
+
+def attempt(parse, file_name: str):
+    try:
+        return file_name, parse(file_name), None
+    except Exception:
+        return file_name, None, traceback.format_exc()
+
+
+def parse_all(parse, file_names, workers: int = 1, initializer=None, initargs=()):
+    """
+    Runs parse over every file name, in a pool of worker processes if
+    workers > 1, and yields (file_name, result, error) triples in the same
+    order as file_names. A file that fails to parse yields its traceback
+    as the error instead of stopping the run. Only a bounded number of
+    files are in flight at once, so results never pile up in the parent.
+    initializer is called with initargs in every worker before it parses
+    anything, so that it sees the same configuration as the parent.
+    """
+    if workers <= 1:
+        for file_name in file_names:
+            yield attempt(parse, file_name)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as pool:
+        in_flight = deque()
+        for file_name in file_names:
+            in_flight.append((file_name, pool.submit(attempt, parse, file_name)))
+            if len(in_flight) >= workers * 4:
+                yield collect(*in_flight.popleft())
+        while len(in_flight) > 0:
+            yield collect(*in_flight.popleft())
+
+
+def collect(file_name: str, future):
+    try:
+        return future.result()
+    except Exception:
+        return file_name, None, traceback.format_exc()
+
+
+async def collect_async(file_name: str, future):
+    try:
+        return await future
+    except Exception:
+        return file_name, None, traceback.format_exc()
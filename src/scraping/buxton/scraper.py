@@ -1,41 +1,104 @@
 import os
-from shutil import copyfile
-import docx2txt
-from docx import Document
-from docx.opc.constants import RELATIONSHIP_TYPE as RT
-import re
 from pymongo import MongoClient
 import shutil
 import uuid
+import time
+import asyncio
 import datetime
 from PIL import Image
-import math
+import argparse
+import traceback
+from bulk_writer import BulkWriter, AsyncBulkWriter
+from bundles import BundleStore
+from buxton_parser import parse_device
+from dash_model import SLOT, Doc, Template, Proxy, PrefetchProxy, List, Date, ImageField, RichTextField
+from docx_reader import read_docx
+from image_store import ImageStore, GridFSImageStore, stored_digest
+from instrument import Trace, Recorder
+from interning import InternCache, normalize_text
+from solr_feed import SolrFeed
+from staging import StagingLoad, chunks
+from manifest import Manifest, file_digest
+from parallel import is_candidate, parse_all, attempt, collect_async
+from variants import write_all_variants
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 source = "./source"
 filesPath = "../../server/public/files"
 image_dist = filesPath + "/images/buxton"
-
-db = MongoClient("localhost", 27017)["Dash"]
-target_collection = db.documents
+mongo_uri = "mongodb://localhost:27017"
+trace_memory = False
+profile_files = False
+database = "Dash"
+default_image_url = "http://localhost:1050/files/images/buxton"
+image_url = default_image_url
+bundle_url = "http://localhost:1050/files/bundles/buxton"
+manifest_path = "./manifest.json"
+# (mongo uri, database, bucket) of the GridFS bucket images are stored in
+# instead of image_dist, if any
+image_gridfs = None
+# whether images are filtered and described by their content (image_analysis,
+# which needs numpy) rather than by their shape alone
+analyze_images = False
+# with analysis, images narrower and shorter than this are dropped unread
+min_image_side = 100
+
+# ids are derived from stable keys (source file plus field path) under this
+# namespace, so re-importing a document overwrites rather than duplicates it
+id_namespace = uuid.uuid5(uuid.NAMESPACE_URL, "dash/scraping/buxton")
+
+# the image store of this process, which every worker opens for itself
+opened_store = None
+opened_store_pid = None
+probed_sizes = {}
+analyzed_images = {}
 target_doc_title = "Collection 1"
-schema_guids = []
-common_proto_id = ""
-
-
-def extract_links(fileName):
-    links = []
-    doc = Document(fileName)
-    rels = doc.part.rels
-    for rel in rels:
-        item = rels[rel]
-        if item.reltype == RT.HYPERLINK and ".aspx" not in item._target:
-            links.append(item._target)
-    return text_doc_map(links)
-
-
-def extract_value(kv_string):
-    pieces = kv_string.split(":")
-    return (pieces[1] if len(pieces) > 1 else kv_string).strip()
+author = "Bill Buxton"
+
+# the fields every document of a kind shares, held once rather than per document
+COLLECTION_VIEW = Template(proto=SLOT, x=10, y=10, _width=900, _height=600, _panX=0, _panY=0, zIndex=2,
+                           libraryBrush=False, _viewType=SLOT)
+CHILD_VIEW = Template(proto=SLOT, x=10, y=10, _width=400, zIndex=2)
+TEXT_DATA = Template(proto=Proxy("textProto"), data=SLOT, title=SLOT, _nativeWidth=200, author=author,
+                     creationDate=SLOT, isPrototype=True, _autoHeight=True, page=-1, _nativeHeight=200,
+                     _height=200, data_text=SLOT)
+IMAGE_VIEW = Template(proto=SLOT, x=10, y=10, _width=SLOT, zIndex=2, dimUnit="*", dimMagnitude=1)
+IMAGE_DATA = Template(proto=Proxy("imageProto"), data=SLOT, title=SLOT, _nativeWidth=SLOT, author=author,
+                      creationDate=SLOT, isPrototype=True, page=-1, _nativeHeight=SLOT, _height=SLOT)
+# numbers and strings, so that search can filter and sort on them
+ANALYZED_IMAGE_DATA = IMAGE_DATA.extend(image_aspect=SLOT, image_aspect_ratio=SLOT, image_contrast=SLOT,
+                                        image_entropy=SLOT, image_colors=SLOT, image_color_share=SLOT,
+                                        image_hash=SLOT)
+
+
+class Session:
+    """
+    The state of one import: the writer, the manifest, and the search feed,
+    staging load and bundles that follow the writes, if any.
+    """
+
+    def __init__(self, manifest: Manifest, incremental: bool = False, text_cache: InternCache = None,
+                 solr: SolrFeed = None, staging: StagingLoad = None, bundles: BundleStore = None):
+        self.manifest = manifest
+        self.incremental = incremental
+        # the documents already written for each piece of text, by its normalized content
+        self.text_cache = text_cache if text_cache is not None else InternCache()
+        self.solr = solr
+        self.staging = staging
+        self.bundles = bundles
+        self.collection = None
+        self.writer = None
+        self.common_proto_id = ""
+        self.unchanged_documents = 0
+        self.stored_documents = set()
+        self.image_references = 0
+        self.image_bytes = 0
+        self.unique_images = {}
+
+
+def extract_links(targets):
+    return [target for target in targets if ".aspx" not in target]
 
 
 def mkdir_if_absent(path):
@@ -43,389 +106,768 @@ def mkdir_if_absent(path):
         if not os.path.exists(path):
             os.mkdir(path)
     except OSError:
-        print("failed to create the appropriate directory structures for %s" % file_name)
+        print("failed to create the appropriate directory structures for %s" % path)
+
+
+def guid(*key):
+    if len(key) == 0:
+        return str(uuid.uuid4())
+    return str(uuid.uuid5(id_namespace, "/".join(map(str, key))))
+
+
+def store(session: Session, document):
+    """
+    Queues the write of a document unless it was already written during
+    this import or is unchanged since the last one, returning it as sent.
+    """
+    document = document.bson()
+    if session.bundles is not None:
+        session.bundles.add(document)
+    changed = session.manifest.changed(document)
+    # documents shared between devices are recorded against each of them
+    # in the manifest, but only need to be written once per import
+    if document["_id"] in session.stored_documents:
+        return document
+    session.stored_documents.add(document["_id"])
+    if changed or not session.incremental:
+        session.writer.upsert(document)
+        # a staged import is only indexed once it is promoted, by feed_promoted
+        if session.solr is not None and session.staging is None:
+            session.solr.add(document)
+    else:
+        session.unchanged_documents += 1
+    return document
 
 
-def guid():
-    return str(uuid.uuid4())
+def remove(session: Session, ids):
+    # with a staging load, the documents to remove are in the live
+    # collection, so they are only removed once the import is promoted
+    if session.staging is not None:
+        session.staging.delete(ids)
+    else:
+        session.writer.delete(ids)
+        if session.solr is not None:
+            session.solr.delete(ids)
 
 
 def listify(list):
-    return {
-        "fields": list,
-        "__type": "list"
-    }
+    return List(list)
 
 
 def protofy(fieldId):
-    return {
-        "fieldId": fieldId,
-        "__type": "proxy"
-    }
+    return Proxy(fieldId)
+
 
+def creation_date():
+    return Date(datetime.datetime.utcnow().microsecond)
 
-def text_doc_map(string_list):
-    def guid_map(caption):
-        return write_text_doc(caption)
-    return listify(proxify_guids(list(map(guid_map, string_list))))
 
+def text_doc_map(session: Session, string_list, *key, share_views: bool = True):
+    guids = [write_text_doc(session, caption, *key, i, share_view=share_views)
+             for i, caption in enumerate(string_list)]
+    return listify(proxify_guids(guids))
 
-def write_collection(parse_results, display_fields, storage_key, viewType):
+
+def write_collection(session: Session, parse_results, display_fields, storage_key, viewType):
     view_guids = parse_results["child_guids"]
 
     data_doc = parse_results["schema"]
-    fields = data_doc["fields"]
-
-    view_doc_guid = guid()
-
-    view_doc = {
-        "_id": view_doc_guid,
-        "fields": {
-            "proto": protofy(data_doc["_id"]),
-            "x": 10,
-            "y": 10,
-            "_width": 900,
-            "_height": 600,
-            "_panX": 0,
-            "_panY": 0,
-            "zIndex": 2,
-            "libraryBrush": False,
-            "_viewType": viewType,
-        },
-        "__type": "Doc"
-    }
+    fields = data_doc.fields
 
-    fields["proto"] = protofy(common_proto_id)
+    view_doc = COLLECTION_VIEW.doc(guid(data_doc.id, "view"), protofy(data_doc.id), viewType)
+
+    fields["proto"] = protofy(session.common_proto_id)
     fields[storage_key] = listify(proxify_guids(view_guids))
     fields["_columnHeaders"] = listify(display_fields)
-    fields["author"] = "Bill Buxton"
-    fields["creationDate"] = {
-        "date": datetime.datetime.utcnow().microsecond,
-        "__type": "date"
-    }
-    if "image_urls" in parse_results:
-        fields["hero"] = {
-            "url": parse_results["image_urls"][0],
-            "__type": "image"
-        }
+    fields["author"] = author
+    fields["creationDate"] = creation_date()
+    # a collection whose source had no pictures worth keeping has no hero
+    if len(parse_results.get("image_urls", [])) > 0:
+        fields["hero"] = ImageField(parse_results["image_urls"][0])
     fields["isPrototype"] = True
+    # the view's bundle holds everything below it, so a client can fetch
+    # the whole collection from there in one read
+    if session.bundles is not None:
+        fields["bundle"] = session.bundles.url(view_doc.id)
+
+    store(session, data_doc)
+    store(session, view_doc)
+
+    # print(f"inserted view document ({view_doc.id})")
+    # print(f"inserted data document ({data_doc.id})\n")
+
+    return view_doc.id
+
+
+def write_text_doc(session: Session, content, *key, share_view: bool = True):
+    """
+    Writes a text document, keyed by its normalized content, so that every
+    device listing the same text shares one data document. Unless the view
+    is positioned within a collection (share_view is False), the view is
+    shared as well. Documents already written during this import are only
+    recorded against the file being written, not built again.
+    """
+    content = normalize_text(content)
+    written = session.text_cache.get(content)
+    if written is None:
+        written = {}
+        session.text_cache.put(content, written)
+
+    def intern(id, build):
+        if id in written:
+            digest, document = written[id]
+            session.manifest.record(id, digest)
+            if session.bundles is not None:
+                session.bundles.add(document)
+        else:
+            document = store(session, build())
+            written[id] = session.manifest.documents[id], document
 
-    target_collection.insert_one(data_doc)
-    target_collection.insert_one(view_doc)
+    data_doc_guid = guid("text", content, "data")
+    intern(data_doc_guid,
+           lambda: TEXT_DATA.doc(data_doc_guid, RichTextField(content), content, creation_date(), content))
 
-    data_doc_guid = data_doc["_id"]
-    # print(f"inserted view document ({view_doc_guid})")
-    # print(f"inserted data document ({data_doc_guid})\n")
+    if share_view:
+        view_doc_guid = guid("text", content, "view")
+        intern(view_doc_guid, lambda: CHILD_VIEW.doc(view_doc_guid, protofy(data_doc_guid)))
+    else:
+        view_doc_guid = guid(*key, "view")
+        store(session, CHILD_VIEW.doc(view_doc_guid, protofy(data_doc_guid)))
 
     return view_doc_guid
 
 
-def write_text_doc(content):
-    data_doc_guid = guid()
-    view_doc_guid = guid()
-
-    view_doc = {
-        "_id": view_doc_guid,
-        "fields": {
-            "proto": protofy(data_doc_guid),
-            "x": 10,
-            "y": 10,
-            "_width": 400,
-            "zIndex": 2
-        },
-        "__type": "Doc"
-    }
+def write_image(session: Session, file_name, image):
+    path = image["url"]
+    name = image["name"]
+    native_width = image["width"]
+    native_height = image["height"]
 
-    data_doc = {
-        "_id": data_doc_guid,
-        "fields": {
-            "proto": protofy("textProto"),
-            "data": {
-                "Data": '{"doc":{"type":"doc","content":[{"type":"paragraph","content":[{"type":"text","text":"' + content + '"}]}]},"selection":{"type":"text","anchor":1,"head":1}' + '}',
-                "__type": "RichTextField"
-            },
-            "title": content,
-            "_nativeWidth": 200,
-            "author": "Bill Buxton",
-            "creationDate": {
-                "date": datetime.datetime.utcnow().microsecond,
-                "__type": "date"
-            },
-            "isPrototype": True,
-            "_autoHeight": True,
-            "page": -1,
-            "_nativeHeight": 200,
-            "_height": 200,
-            "data_text": content
-        },
-        "__type": "Doc"
-    }
+    session.image_references += 1
+    session.image_bytes += image["size"]
+    session.unique_images[image["digest"]] = image["size"]
 
-    target_collection.insert_one(view_doc)
-    target_collection.insert_one(data_doc)
+    # every device showing the same picture gets its own view of one
+    # shared data document, keyed by the content of the image
+    data_doc_guid = guid(image["digest"], "data")
+    view_doc_guid = guid(file_name, name, "view")
 
-    return view_doc_guid
+    store(session, IMAGE_VIEW.doc(view_doc_guid, protofy(data_doc_guid), min(800, native_width)))
+    features = image.get("features")
+    if features is None:
+        store(session, IMAGE_DATA.doc(data_doc_guid, ImageField(path), name, native_width, creation_date(),
+                             native_height, native_height))
+    else:
+        store(session, ANALYZED_IMAGE_DATA.doc(
+            data_doc_guid, ImageField(path), name, native_width, creation_date(), native_height, native_height,
+            features["aspect"], features["aspect_ratio"], features["contrast"], features["entropy"],
+            listify(features["colours"]), features["colour_shares"][0], features["hash"]))
 
+    return {
+        "layout_id": view_doc_guid,
+        "url": path
+    }
 
-def write_image(folder, name):
-    path = f"http://localhost:1050/files/images/buxton/{folder}/{name}"
 
-    data_doc_guid = guid()
-    view_doc_guid = guid()
+def is_photo(width: int, height: int):
+    # near-square images are the icons and bullets of the document's layout
+    return abs(width - height) >= 10
+
+
+def accepts_size(width: int, height: int):
+    if analyze_images:
+        return max(width, height) >= min_image_side
+    return is_photo(width, height)
+
+
+def analyze(images, sizes, trace):
+    """
+    Describes the content of every image not analyzed before in this
+    process, in one batch, returning the features of all of them.
+    """
+    from image_analysis import analyze_batch
+    pending = [i for i, image in enumerate(images) if image["digest"] not in analyzed_images]
+    if len(pending) > 0:
+        with trace.stage("image_analysis"):
+            store = image_store()
+            features = analyze_batch([partial(store.open, images[i]) for i in pending], [sizes[i] for i in pending])
+        for i, described in zip(pending, features):
+            analyzed_images[images[i]["digest"]] = described
+    return [analyzed_images[image["digest"]] for image in images]
+
+
+def extract_images(stored, variant_threads, trace):
+    extracted = []
+    variant_jobs = []
+    sizes = []
+    for image in stored:
+        if "width" in image:
+            native_width, native_height = image["width"], image["height"]
+        else:
+            # read_docx could not probe the header, so measure the stored file
+            if image["digest"] not in probed_sizes:
+                with trace.stage("image_probe"):
+                    with image_store().open(image) as stored_image:
+                        probed_sizes[image["digest"]] = Image.open(stored_image).size
+            native_width, native_height = probed_sizes[image["digest"]]
+        sizes.append((native_width, native_height))
+
+    if analyze_images:
+        from image_analysis import is_picture
+        described = analyze(stored, sizes, trace)
+        kept = [is_picture(features) for features in described]
+    else:
+        described = [None] * len(stored)
+        kept = [accepts_size(*size) for size in sizes]
+    for image, (native_width, native_height), features, keep in zip(stored, sizes, described, kept):
+        if not keep:
+            continue
+        extracted_image = {
+            "name": image["name"],
+            "digest": image["digest"],
+            "url": image["url"],
+            "size": image["size"],
+            "width": native_width,
+            "height": native_height
+        }
+        if features is not None:
+            extracted_image["features"] = features
+        extracted.append(extracted_image)
+        # variants only need to be made by whoever first stored the payload
+        if image["new"]:
+            variant_jobs.append((image, native_width))
+    with trace.stage("variants"):
+        write_all_variants(variant_jobs, variant_threads, image_store().write_variants)
+    return extracted
+
+
+def configure(source_dir: str, files_dir: str, memory: bool = False, profile: bool = False,
+              images_url: str = None, gridfs=None, analyze: bool = False):
+    global source, filesPath, image_dist, trace_memory, profile_files, image_url, image_gridfs, opened_store
+    global analyze_images
+    source = source_dir
+    filesPath = files_dir
+    image_dist = filesPath + "/images/buxton"
+    trace_memory = memory
+    profile_files = profile
+    image_url = images_url if images_url is not None else default_image_url
+    image_gridfs = gridfs
+    analyze_images = analyze
+    opened_store = None
+
+
+def image_store():
+    """
+    Returns the store extracted images are written to, opened at most once
+    per process, so that no worker uses a database connection it inherited.
+    """
+    global opened_store, opened_store_pid
+    if opened_store is None or opened_store_pid != os.getpid():
+        if image_gridfs is not None:
+            opened_store = GridFSImageStore(*image_gridfs, image_url)
+        else:
+            opened_store = ImageStore(image_dist, image_url)
+        opened_store_pid = os.getpid()
+    return opened_store
+
+
+def feed_promoted(session: Session, collection):
+    """
+    Indexes the documents a staged import moved into collection and drops
+    the ones it removed from the index. Until then none of them is sent to
+    Solr, so that the index never describes an import that was not promoted.
+    """
+    staging = session.staging
+    for chunk in chunks(staging.staged, 1000):
+        for document in collection.find({"_id": {"$in": chunk}}):
+            session.solr.add(document)
+    session.solr.delete(list(staging.deleted - staging.staged))
+
+
+def sweep_images(collection):
+    """
+    Removes the stored images that no document in collection refers to any
+    more, whichever importer wrote them, since the store is shared and only
+    ever added to while importing.
+    """
+    keep = set()
+    for document in collection.find({"fields.data.__type": "image"}, {"fields.data.url": 1}):
+        keep.add(stored_digest(document["fields"]["data"]["url"].rsplit("/", 1)[-1]))
+    removed = image_store().sweep(keep)
+    if removed > 0:
+        print(f"removed {removed} stored image files no document refers to")
+
+
+def parse_document(file_name: str, variant_threads: int = 4, extract: bool = True):
+    """
+    Extracts everything the importer needs from a single device document
+    without touching the database, so that it can safely run in a worker
+    process. The result is handed to write_document in the parent. If
+    extract is False, the stored images are returned as they are and
+    probing and resizing them is left to process_images.
+    """
+    print(f"parsing {file_name}...")
+    trace = Trace(file_name, trace_memory, profile_files)
 
-    image = Image.open(f"{image_dist}/{folder}/{name}")
-    native_width, native_height = image.size
+    result = {}
 
-    if abs(native_width - native_height) < 10:
-        return None
+    contents = read_docx(source + "/" + file_name, image_store(), trace, accept=accepts_size)
+    raw = contents["text"]
 
-    view_doc = {
-        "_id": view_doc_guid,
-        "fields": {
-            "proto": protofy(data_doc_guid),
-            "x": 10,
-            "y": 10,
-            "_width": min(800, native_width),
-            "zIndex": 2,
-            "dimUnit": "*",
-            "dimMagnitude": 1
-        },
-        "__type": "Doc"
-    }
+    if extract:
+        extracted = extract_images(contents["images"], variant_threads, trace)
+        # print(f"extracted {len(extracted)} images...")
+    else:
+        extracted = contents["images"]
 
-    data_doc = {
-        "_id": data_doc_guid,
-        "fields": {
-            "proto": protofy("imageProto"),
-            "data": {
-                "url": path,
-                "__type": "image"
-            },
-            "title": name,
-            "_nativeWidth": native_width,
-            "author": "Bill Buxton",
-            "creationDate": {
-                "date": datetime.datetime.utcnow().microsecond,
-                "__type": "date"
-            },
-            "isPrototype": True,
-            "page": -1,
-            "_nativeHeight": native_height,
-            "_height": native_height
-        },
-        "__type": "Doc"
-    }
+    with trace.stage("parse"):
+        record = parse_device(raw)
 
-    target_collection.insert_one(view_doc)
-    target_collection.insert_one(data_doc)
+    result["file_name"] = file_name
+    result["title"] = record.title
+    result["short_description"] = record.short_description
+    result["buxton_notes"] = record.buxton_notes
+    result["company"] = record.company
+    result["year"] = record.year
+    result["original_price"] = record.original_price
+    result["degrees_of_freedom"] = record.degrees_of_freedom
+    result["dimensions"] = record.dimensions
+    result["primary_key"] = record.primary_key
+    result["secondary_key"] = record.secondary_key
+    result["link_descriptions"] = record.link_descriptions
+    result["hyperlinks"] = extract_links(contents["hyperlinks"])
+    result["images"] = listify(record.table_image_names)
+    result["captions"] = record.captions
+    if len(record.notes) > 0:
+        result["notes"] = listify(record.notes)
 
     return {
-        "layout_id": view_doc_guid,
-        "url": path
+        "fields": result,
+        "images": extracted,
+        "trace": trace.finish()
     }
 
 
-def parse_document(file_name: str):
-    print(f"parsing {file_name}...")
-    pure_name = file_name.split(".")[0]
-
-    result = {}
-
-    dir_path = image_dist + "/" + pure_name
-    # print(dir_path)
-    mkdir_if_absent(dir_path)
+def process_images(parsed, variant_threads: int = 4):
+    trace = parsed["trace"]
+    start = time.perf_counter()
+    parsed["images"] = extract_images(parsed["images"], variant_threads, trace)
+    trace.elapsed += time.perf_counter() - start
+    return parsed
 
-    raw = str(docx2txt.process(source + "/" + file_name, dir_path))
 
+def write_document(session: Session, parsed):
     urls = []
     view_guids = []
-    count = 0
-    for image in os.listdir(dir_path):
-        created = write_image(pure_name, image)
-        if created != None:
-            urls.append(created["url"])
-            view_guids.append(created["layout_id"])
-            count += 1
-            resolved = dir_path + "/" + image
-            original = dir_path + "/" + image.replace(".", "_o.", 1)
-            medium = dir_path + "/" + image.replace(".", "_m.", 1)
-            copyfile(resolved, original)
-            copyfile(resolved, medium)
-    # print(f"extracted {count} images...")
-
-    def sanitize(line): return re.sub("[\n\t]+", "", line).replace(u"\u00A0", " ").replace(
-        u"\u2013", "-").replace(u"\u201c", '''"''').replace(u"\u201d", '''"''').strip()
-
-    def sanitize_price(raw: str):
-        raw = raw.replace(",", "")
-        if "x" in raw.lower():
-            return None
-        start = raw.find("$")
-        if start > -1:
-            i = start + 1
-            while (i < len(raw) and re.match(r"[0-9\.]", raw[i])):
-                i += 1
-            price = raw[start + 1: i + 1]
-            return float(price)
-        elif (raw.lower().find("nfs")):
-            return -1
-        else:
-            return math.nan
-
-    def remove_empty(line): return len(line) > 1
+    for image in parsed["images"]:
+        created = write_image(session, parsed["fields"]["file_name"], image)
+        urls.append(created["url"])
+        view_guids.append(created["layout_id"])
 
-    def try_parse(to_parse: int):
-        value: int
-        try:
-            value = int(to_parse)
-        except ValueError:
-            value = None
-        return value
-
-    lines = list(map(sanitize, raw.split("\n")))
-    lines = list(filter(remove_empty, lines))
-
-    result["file_name"] = file_name
-    result["title"] = lines[2].strip()
-    result["short_description"] = lines[3].strip().replace(
-        "Short Description: ", "")
-
-    cur = 5
-    notes = ""
-    while lines[cur] != "Device Details":
-        notes += lines[cur] + " "
-        cur += 1
-    result["buxton_notes"] = notes.strip()
-
-    cur += 1
-    clean = list(
-        map(lambda data: data.strip().split(":"), lines[cur].split("|")))
-    result["company"] = clean[0][len(clean[0]) - 1].strip()
-    result["year"] = try_parse(clean[1][len(clean[1]) - 1].strip())
-    result["original_price"] = sanitize_price(
-        clean[2][len(clean[2]) - 1].strip())
-
-    cur += 1
-    result["degrees_of_freedom"] = try_parse(extract_value(
-        lines[cur]).replace("NA", "N/A"))
-    cur += 1
-
-    dimensions = lines[cur].lower()
-    if dimensions.startswith("dimensions"):
-        dim_concat = dimensions[11:].strip()
-        cur += 1
-        while lines[cur] != "Key Words":
-            dim_concat += (" " + lines[cur].strip())
-            cur += 1
-        result["dimensions"] = dim_concat
-    else:
-        result["dimensions"] = "N/A"
-
-    cur += 1
-    result["primary_key"] = extract_value(lines[cur])
-    cur += 1
-    result["secondary_key"] = extract_value(lines[cur])
-
-    while lines[cur] != "Links":
-        result["secondary_key"] += (" " + extract_value(lines[cur]).strip())
-        cur += 1
-
-    cur += 1
-    link_descriptions = []
-    while lines[cur] != "Image":
-        link_descriptions.append(lines[cur].strip())
-        cur += 1
-    result["link_descriptions"] = text_doc_map(link_descriptions)
-
-    result["hyperlinks"] = extract_links(source + "/" + file_name)
-
-    images = []
-    captions = []
-    cur += 3
-    while cur + 1 < len(lines) and lines[cur] != "NOTES:":
-        images.append(lines[cur])
-        captions.append(lines[cur + 1])
-        cur += 2
-    result["images"] = listify(images)
-
-    result["captions"] = text_doc_map(captions)
-
-    notes = []
-    if (cur < len(lines) and lines[cur] == "NOTES:"):
-        cur += 1
-        while cur < len(lines):
-            notes.append(lines[cur])
-            cur += 1
-    if len(notes) > 0:
-        result["notes"] = listify(notes)
+    result = parsed["fields"]
+    file_name = result["file_name"]
+    for key in ["link_descriptions", "hyperlinks", "captions"]:
+        result[key] = text_doc_map(session, result[key], file_name, key)
 
     # print("writing child schema...")
 
     return {
-        "schema": {
-            "_id": guid(),
-            "fields": result,
-            "__type": "Doc"
-        },
+        "schema": Doc(guid(file_name, "schema"), result),
         "child_guids": view_guids,
         "image_urls": urls
     }
 
 
 def proxify_guids(guids):
-    return list(map(lambda guid: {"fieldId": guid, "__type": "prefetch_proxy"}, guids))
-
-
-def write_common_proto():
-    id = guid()
-    common_proto = {
-        "_id": id,
-        "fields": {
-            "proto": protofy("collectionProto"),
-            "title": "The Buxton Collection",
-        },
-        "__type": "Doc"
-    }
-    target_collection.insert_one(common_proto)
+    return [PrefetchProxy(guid) for guid in guids]
+
+
+def write_common_proto(session: Session):
+    id = guid("common proto")
+    store(session, Doc(id, {
+        "proto": protofy("collectionProto"),
+        "title": "The Buxton Collection",
+    }))
     return id
 
 
-if os.path.exists(image_dist):
-    shutil.rmtree(image_dist, True)
-while os.path.exists(image_dist):
-    pass
-os.mkdir(image_dist)
-mkdir_if_absent(source)
-
-common_proto_id = write_common_proto()
-
-candidates = 0
-for file_name in os.listdir(source):
-    if file_name.endswith('.docx') or file_name.endswith('.doc'):
-        candidates += 1
-        schema_guids.append(write_collection(
-            parse_document(file_name), ["title", "data"], "data", 5))
-
-print("writing parent schema...")
-parent_guid = write_collection({
-    "schema": {
-        "_id": guid(),
-        "fields": {},
-        "__type": "Doc"
-    },
-    "child_guids": schema_guids
-}, ["title", "short_description", "original_price"], "data", 4)
-
-print("appending parent schema to main workspace...\n")
-target_collection.update_one(
-    {"fields.title": target_doc_title},
-    {"$push": {"fields.data.fields": {"fieldId": parent_guid, "__type": "proxy"}}}
-)
-
-print("rewriting .gitignore...\n")
-lines = ['*', '!.gitignore']
-with open(filesPath + "/.gitignore", 'w') as f:
-    f.write('\n'.join(lines))
-
-suffix = "" if candidates == 1 else "s"
-print(f"conversion complete. {candidates} candidate{suffix} processed.")
+def begin_import(session: Session):
+    session.manifest.begin("<common proto>")
+    if session.bundles is not None:
+        session.bundles.begin()
+    session.common_proto_id = write_common_proto(session)
+    if session.bundles is not None:
+        session.bundles.share()
+    remove(session, session.manifest.end(None, session.common_proto_id))
+
+
+def import_parsed(session: Session, file_name, parsed, error, digest, layouts):
+    """
+    Builds the documents of one parsed source file and queues their writes,
+    returning the file's trace, or None if it failed to parse or its
+    documents could not be built.
+    """
+    manifest = session.manifest
+    bundles = session.bundles
+    if error is not None:
+        print(f"failed to parse {file_name}, skipping...\n{error}")
+        # whatever the last successful import wrote for it is left in place
+        layouts[file_name] = manifest.layout(file_name)
+        return None
+    trace = parsed["trace"]
+    manifest.begin(file_name)
+    if bundles is not None:
+        bundles.begin()
+    try:
+        with trace.stage("build_documents"):
+            layout = write_collection(session, write_document(session, parsed), ["title", "data"], "data", 5)
+    except Exception:
+        print(f"failed to build the documents of {file_name}, skipping...\n{traceback.format_exc()}")
+        manifest.abandon()
+        if bundles is not None:
+            bundles.discard()
+        layouts[file_name] = manifest.layout(file_name)
+        return None
+    remove(session, manifest.end(digest, layout))
+    if bundles is not None:
+        with trace.stage("bundle"):
+            bundles.end(layout)
+    layouts[file_name] = layout
+    return trace
+
+
+def record_trace(session: Session, recorder, trace, batches):
+    trace.elapsed += sum(trace.stages.get(stage, 0)
+                         for stage in ["build_documents", "bundle", "mongo_write", "solr_feed"])
+    recorder.record(trace, mongo_batches_ms=session.writer.latencies[batches:])
+
+
+def finish_import(session: Session, candidates, digests, layouts):
+    """
+    Removes the documents of deleted source files and writes the parent
+    schema, returning the filter and update that add it to the workspace.
+    """
+    manifest = session.manifest
+    bundles = session.bundles
+    for file_name in list(manifest.files):
+        if not file_name.startswith("<") and file_name not in digests:
+            print(f"removing documents of deleted source {file_name}...")
+            if bundles is not None:
+                bundles.remove(manifest.layout(file_name))
+            remove(session, manifest.forget(file_name))
+
+    schema_guids = [layouts[name] for name in candidates if layouts[name] is not None]
+
+    print("writing parent schema...")
+    manifest.begin("<parent schema>")
+    if bundles is not None:
+        bundles.begin()
+    parent_guid = write_collection(session, {
+        "schema": Doc(guid("parent schema")),
+        "child_guids": schema_guids
+    }, ["title", "short_description", "original_price"], "data", 4)
+    remove(session, manifest.end(None, parent_guid))
+    if bundles is not None:
+        if bundles.changed or not bundles.exists(parent_guid):
+            print("bundling parent schema...")
+            # the devices' own bundles already hold everything below them
+            for layout in schema_guids:
+                for document in bundles.load(layout):
+                    bundles.add(document)
+            bundles.end(parent_guid)
+        else:
+            bundles.discard()
+
+    print("appending parent schema to main workspace...\n")
+    # the parent id is stable across imports, so adding it as a set member
+    # keeps repeated imports from listing it in the workspace more than once
+    return (
+        {"fields.title": target_doc_title},
+        {"$addToSet": {"fields.data.fields": {"fieldId": parent_guid, "__type": "proxy"}}}
+    )
+
+
+def import_serial(session: Session, args, settings, candidates, to_parse, digests, layouts, recorder):
+    staging = session.staging
+    db = MongoClient(args.mongo_uri)[args.database]
+    session.collection = db[staging.name if staging is not None else "documents"]
+    session.writer = writer = BulkWriter(session.collection, args.batch_size)
+    begin_import(session)
+
+    failures = 0
+    for file_name, parsed, error in parse_all(
+            partial(parse_document, variant_threads=args.variant_threads), to_parse, args.workers,
+            configure, settings):
+        trace = import_parsed(session, file_name, parsed, error, digests.get(file_name), layouts)
+        if trace is None:
+            failures += 1
+            continue
+        batches = len(writer.latencies)
+        with trace.stage("mongo_write"):
+            writer.flush()
+        if session.solr is not None:
+            with trace.stage("solr_feed"):
+                session.solr.flush()
+        record_trace(session, recorder, trace, batches)
+
+    workspace = finish_import(session, candidates, digests, layouts)
+    if staging is not None:
+        writer.flush()
+        staging.update_one(*workspace)
+    else:
+        writer.update_one(*workspace)
+    return failures
+
+
+async def import_async(session: Session, args, settings, candidates, to_parse, digests, layouts, recorder):
+    """
+    The --async import. Documents are parsed in a process pool, their images
+    probed and resized in a thread pool, and the database written through
+    motor, with each stage handing its results to the next through a
+    bounded queue. The stages overlap, but a stage that gets ahead waits
+    for room in its queue, so only a few files are held in memory at once.
+    """
+    from motor.motor_asyncio import AsyncIOMotorClient
+    staging = session.staging
+    db = AsyncIOMotorClient(args.mongo_uri)[args.database]
+    session.collection = db[staging.name if staging is not None else "documents"]
+    session.writer = writer = AsyncBulkWriter(session.collection, args.batch_size, args.max_in_flight)
+    begin_import(session)
+
+    loop = asyncio.get_running_loop()
+    parsed_queue = asyncio.Queue(args.queue_size)
+    image_queue = asyncio.Queue(args.queue_size)
+    parse = partial(parse_document, variant_threads=args.variant_threads, extract=False)
+
+    def extract(file_name, parsed):
+        try:
+            return file_name, process_images(parsed, args.variant_threads), None
+        except Exception:
+            return file_name, None, traceback.format_exc()
+
+    async def parse_stage(processes):
+        for file_name in to_parse:
+            await parsed_queue.put((file_name, loop.run_in_executor(processes, attempt, parse, file_name)))
+        await parsed_queue.put(None)
+
+    async def image_stage(threads):
+        while True:
+            item = await parsed_queue.get()
+            if item is None:
+                await image_queue.put(None)
+                return
+            file_name, parsed, error = await collect_async(*item)
+            if error is None:
+                future = loop.run_in_executor(threads, extract, file_name, parsed)
+            else:
+                future = loop.create_future()
+                future.set_result((file_name, None, error))
+            await image_queue.put((file_name, future))
+
+    async def write_stage():
+        failures = 0
+        while True:
+            item = await image_queue.get()
+            if item is None:
+                return failures
+            file_name, parsed, error = await collect_async(*item)
+            trace = import_parsed(session, file_name, parsed, error, digests.get(file_name), layouts)
+            if trace is None:
+                failures += 1
+                continue
+            batches = len(writer.latencies)
+            with trace.stage("mongo_write"):
+                await writer.drain()
+            if session.solr is not None:
+                with trace.stage("solr_feed"):
+                    await loop.run_in_executor(None, session.solr.flush)
+            record_trace(session, recorder, trace, batches)
+
+    with ProcessPoolExecutor(max(1, args.workers), initializer=configure, initargs=settings) as processes, \
+            ThreadPoolExecutor(args.image_threads) as threads:
+        _, _, failures = await asyncio.gather(parse_stage(processes), image_stage(threads), write_stage())
+
+    workspace = finish_import(session, candidates, digests, layouts)
+    if staging is not None:
+        await writer.flush()
+        staging.update_one(*workspace)
+    else:
+        await writer.update_one(*workspace)
+    return failures
+
+
+def add_image_arguments(parser):
+    parser.add_argument("--image-url",
+                        help="the URL images are served from, which image documents refer to them by "
+                             f"(default {default_image_url}; required with --gridfs)")
+    parser.add_argument("--gridfs", metavar="BUCKET",
+                        help="store images in this GridFS bucket of the database instead of under --files-path, "
+                             "which the Dash server does not serve")
+    parser.add_argument("--analyze", action="store_true",
+                        help="drop blank and graphic images rather than near-square ones, and store each image's "
+                             "colours, contrast, aspect and perceptual hash (needs numpy)")
+
+
+def gridfs_bucket(parser, args):
+    if args.gridfs is None:
+        return None
+    if args.image_url is None:
+        parser.error("--gridfs needs --image-url, the URL the bucket's files are published under")
+    return args.mongo_uri, args.database, args.gridfs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import Buxton device documents into Dash")
+    parser.add_argument("--batch-size", type=int, default=1000,
+                        help="maximum number of operations sent per bulk write")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes used to parse documents")
+    parser.add_argument("--variant-threads", type=int, default=4,
+                        help="number of images resized at once within each process")
+    parser.add_argument("--incremental", action="store_true",
+                        help="skip unchanged source files and only write documents whose content changed")
+    parser.add_argument("--source", default=source,
+                        help="folder containing the device documents")
+    parser.add_argument("--files-path", default=filesPath,
+                        help="the server's public files folder, where images are written")
+    parser.add_argument("--manifest", default=manifest_path,
+                        help="where the incremental import manifest is kept")
+    parser.add_argument("--trace",
+                        help="write per-file and aggregate stage timings to this file as JSON lines")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="also record each file's peak traced memory (slows the import down)")
+    parser.add_argument("--profile-slowest", type=int, default=0,
+                        help="keep cProfile dumps of the N slowest files")
+    parser.add_argument("--profile-dir", default="./profiles",
+                        help="where the --profile-slowest dumps are written")
+    parser.add_argument("--solr",
+                        help="also index written documents into this Solr core, e.g. http://localhost:8983/solr/dash")
+    parser.add_argument("--solr-dump",
+                        help="write the Solr update batches as JSON files into this folder instead of posting them, "
+                             "replacing those of an earlier dump")
+    parser.add_argument("--solr-batch-size", type=int, default=500)
+    parser.add_argument("--solr-commit-within", type=int, default=10000,
+                        help="milliseconds within which Solr should make each batch searchable")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="overlap parsing, image processing and database writes with asyncio (needs motor)")
+    parser.add_argument("--queue-size", type=int, default=8,
+                        help="with --async, how many files each stage may get ahead of the next")
+    parser.add_argument("--image-threads", type=int, default=2,
+                        help="with --async, number of files whose images are processed at once")
+    parser.add_argument("--max-in-flight", type=int, default=4,
+                        help="with --async, number of bulk writes outstanding before building documents waits")
+    add_image_arguments(parser)
+    parser.add_argument("--bundles", action="store_true",
+                        help="also write every collection's documents as one gzipped JSON file under files/bundles, "
+                             "whose URL the collection records as its bundle field")
+    parser.add_argument("--text-cache-size", type=int, default=10000,
+                        help="number of distinct texts whose documents are remembered to be shared")
+    parser.add_argument("--staging", action="store_true",
+                        help="load into a staging collection and only move it into documents once it validates")
+    parser.add_argument("--staging-collection", default="documents_staging",
+                        help="with --staging, the collection the import is loaded into")
+    parser.add_argument("--mongo-uri", default=mongo_uri)
+    parser.add_argument("--database", default=database)
+    args = parser.parse_args(argv)
+    incremental = args.incremental
+    gridfs = gridfs_bucket(parser, args)
+    settings = (args.source, args.files_path, args.trace_memory, args.profile_slowest > 0, args.image_url, gridfs,
+                args.analyze)
+    configure(*settings)
+    recorder = Recorder(args.trace, args.profile_dir, args.profile_slowest)
+
+    manifest = Manifest(args.manifest)
+    session = Session(manifest, incremental, InternCache(args.text_cache_size))
+    if args.solr is not None or args.solr_dump is not None:
+        session.solr = SolrFeed(args.solr or "http://localhost:8983/solr/dash", args.solr_batch_size,
+                                args.solr_commit_within, args.solr_dump)
+
+    # the image store is shared with the narrative import, so it is never
+    # wiped; what no document refers to any more is swept after the import
+    if gridfs is None:
+        os.makedirs(image_dist, exist_ok=True)
+    mkdir_if_absent(source)
+    if args.bundles:
+        bundle_dist = filesPath + "/bundles/buxton"
+        # a staged import replaces the bundles only once it is promoted
+        if not incremental and not args.staging:
+            shutil.rmtree(bundle_dist, True)
+        session.bundles = BundleStore(bundle_dist, bundle_url, staged=args.staging)
+
+    candidates = sorted(filter(is_candidate, os.listdir(source)))
+    digests = {name: file_digest(source + "/" + name) for name in candidates}
+    layouts = {}
+    to_parse = []
+    for file_name in candidates:
+        if incremental and manifest.unchanged(file_name, digests[file_name]):
+            layouts[file_name] = manifest.layout(file_name)
+        else:
+            to_parse.append(file_name)
+    print(f"{len(candidates) - len(to_parse)} unchanged candidates skipped")
+
+    if args.staging:
+        session.staging = StagingLoad(MongoClient(args.mongo_uri)[args.database], "documents",
+                                      args.staging_collection)
+        session.staging.begin()
+
+    if args.use_async:
+        failures = asyncio.run(import_async(session, args, settings, candidates, to_parse, digests, layouts,
+                                            recorder))
+    else:
+        failures = import_serial(session, args, settings, candidates, to_parse, digests, layouts, recorder)
+
+    print(f"database writes: {session.writer.report()}")
+    staging = session.staging
+    promoted = True
+    if staging is not None:
+        print(f"promoting {staging.name} into documents...")
+        promoted = len(staging.promote()) == 0
+        if session.bundles is not None:
+            if promoted:
+                session.bundles.promote(replace=not incremental)
+            else:
+                session.bundles.abandon()
+        if promoted and session.solr is not None:
+            feed_promoted(session, MongoClient(args.mongo_uri)[args.database].documents)
+    if session.solr is not None:
+        session.solr.flush()
+        print(f"search index: {session.solr.report()}")
+    print(f"{session.unchanged_documents} unchanged documents skipped")
+    print(f"shared text documents: {session.text_cache.report()}")
+    if session.bundles is not None:
+        print(f"collection bundles: {session.bundles.report()}")
+    if session.image_references > 0:
+        references = session.image_references
+        unique_images = session.unique_images
+        stored_bytes = sum(unique_images.values())
+        print(f"{references} image references to {len(unique_images)} unique payloads "
+              f"(dedup ratio {references / len(unique_images):.2f}, "
+              f"{session.image_bytes - stored_bytes} of {session.image_bytes} bytes saved)\n")
+    # the manifest describes what the live collection holds, so it is left
+    # as it was if the staged import never got there
+    if promoted:
+        manifest.save()
+        sweep_images(MongoClient(args.mongo_uri)[args.database].documents)
+
+    aggregate = recorder.close()
+    if aggregate["files"] > 0:
+        print("time per stage:")
+        for stage, total in sorted(aggregate["stages"].items(), key=lambda item: -item[1]["seconds"]):
+            print(f"  {stage:<18}{total['seconds']:9.3f} s total {total['mean'] * 1000:9.2f} ms mean "
+                  f"{total['max'] * 1000:9.2f} ms max")
+        print()
+
+    print("rewriting .gitignore...\n")
+    lines = ['*', '!.gitignore']
+    with open(filesPath + "/.gitignore", 'w') as f:
+        f.write('\n'.join(lines))
+
+    suffix = "" if len(candidates) == 1 else "s"
+    print(f"conversion complete. {len(candidates)} candidate{suffix} processed, {failures} failed.")
+    if not promoted:
+        print(f"the import was left in {staging.name} and documents was not changed.")
+    return session
+
+
+if __name__ == "__main__":
+    main()
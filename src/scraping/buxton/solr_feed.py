@@ -0,0 +1,169 @@
+import os
+import re
+import json
+import time
+import datetime
+import urllib.error
+import urllib.request
+
+
+def iso_date(milliseconds):
+    moment = datetime.datetime.fromtimestamp(milliseconds / 1000, datetime.timezone.utc)
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.") + f"{moment.microsecond // 1000:03d}Z"
+
+
+def list_terms(value):
+    terms = [search_term(item) for item in value["fields"]]
+    return [term[1] for term in terms if term is not None] or None
+
+
+# the suffixMap of ToSearchTerm in src/server/websocket.ts, which indexes
+# fields as clients change them: each Dash field type maps onto one of the
+# dash core's dynamic field suffixes and, for object fields, the value that
+# is indexed. prefetch_proxy is left out there, so the collections' data
+# lists are not indexed; the full reindex in SearchManager.ts maps it like
+# a proxy, but an import should match what later edits keep up to date
+SUFFIXES = {
+    "number": ("_n", None),
+    "string": ("_t", None),
+    "boolean": ("_b", None),
+    "image": ("_t", lambda value: value.get("url")),
+    "video": ("_t", lambda value: value.get("url")),
+    "pdf": ("_t", lambda value: value.get("url")),
+    "audio": ("_t", lambda value: value.get("url")),
+    "web": ("_t", lambda value: value.get("url")),
+    "script": ("_t", lambda value: value["script"]["originalScript"]),
+    "RichTextField": ("_t", lambda value: value.get("Text")),
+    "date": ("_d", lambda value: iso_date(value["date"])),
+    "proxy": ("_i", lambda value: value["fieldId"]),
+    "list": ("_l", list_terms)
+}
+
+
+def field_type(value):
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, dict):
+        return value.get("__type")
+    return None
+
+
+def search_term(value):
+    """
+    Returns the (suffix, value) pair a field is indexed under, or None if
+    the field is not searchable.
+    """
+    if value is None:
+        return None
+    mapping = SUFFIXES.get(field_type(value))
+    if mapping is None:
+        return None
+    suffix, accessor = mapping
+    if accessor is not None:
+        value = accessor(value)
+    if value is None:
+        return None
+    return suffix, value
+
+
+def to_update(document):
+    if document.get("__type") != "Doc" or not document.get("fields"):
+        return None
+    update = {"id": document["_id"]}
+    for key, value in document["fields"].items():
+        term = search_term(value)
+        if term is None:
+            continue
+        suffix, value = term
+        if key.endswith("lastModified"):
+            update["lastModified" + suffix] = value
+        update[key + suffix] = value
+    return update if len(update) > 1 else None
+
+
+class SolrFeed:
+    """
+    Turns Dash documents into updates for the dash Solr core and sends them
+    to its /update handler in batches with commitWithin, or, if dump_dir is
+    given, writes each batch to a numbered JSON file there instead so that
+    it can be posted later. The batches of an earlier dump into the same
+    folder are removed first, so that posting it never resends them. Failed
+    posts are reported rather than aborting the import, the same way
+    Search.updateDocuments treats them.
+    """
+
+    def __init__(self, url: str = "http://localhost:8983/solr/dash", batch_size: int = 500,
+                 commit_within: int = 10000, dump_dir: str = None, verbose: bool = True):
+        self.url = url.rstrip("/")
+        self.batch_size = max(1, batch_size)
+        self.commit_within = commit_within
+        self.dump_dir = dump_dir
+        self.verbose = verbose
+        self.pending = []
+        self.deleted = []
+        self.batches = 0
+        self.indexed = 0
+        self.failures = 0
+        self.latencies = []
+        if dump_dir is not None:
+            os.makedirs(dump_dir, exist_ok=True)
+            for name in os.listdir(dump_dir):
+                if re.fullmatch(r"batch_[0-9]+\.json", name):
+                    os.remove(f"{dump_dir}/{name}")
+
+    def add(self, document):
+        update = to_update(document)
+        if update is None:
+            return
+        self.pending.append(update)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def delete(self, ids):
+        self.deleted.extend(ids)
+        if len(self.deleted) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.deleted) > 0:
+            self._send({"delete": self.deleted})
+            self.deleted = []
+        while len(self.pending) > 0:
+            batch = self.pending[:self.batch_size]
+            self.pending = self.pending[self.batch_size:]
+            if self._send(batch):
+                self.indexed += len(batch)
+
+    def _send(self, body):
+        self.batches += 1
+        payload = json.dumps(body).encode("utf-8")
+        if self.dump_dir is not None:
+            with open(f"{self.dump_dir}/batch_{self.batches:05d}.json", "wb") as f:
+                f.write(payload)
+            return True
+        request = urllib.request.Request(f"{self.url}/update?commitWithin={self.commit_within}",
+                                         data=payload, headers={"Content-Type": "application/json"})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+        except (urllib.error.URLError, OSError) as error:
+            self.failures += 1
+            if self.verbose:
+                print(f"solr update failed: {error}")
+            return False
+        self.latencies.append((time.perf_counter() - start) * 1000)
+        return True
+
+    def report(self):
+        target = self.dump_dir if self.dump_dir is not None else self.url
+        summary = f"{self.indexed} documents in {self.batches} solr batches to {target}"
+        if len(self.latencies) > 0:
+            summary += f", {sum(self.latencies) / len(self.latencies):.1f} ms mean"
+        if self.failures > 0:
+            summary += f", {self.failures} failed"
+        return summary
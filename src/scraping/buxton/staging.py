@@ -0,0 +1,130 @@
+import re
+import time
+
+PROXY_TYPES = ("proxy", "prefetch_proxy")
+# the prototypes of the document types have these non-guid ids and are
+# created by the first client to load the database if they are missing
+# (see Docs.Prototypes.initialize), so proxies to them never dangle
+PROTOTYPE_ID = re.compile(r"^[A-Za-z]+Proto$")
+
+
+def proxy_targets(value, found: set):
+    """
+    Adds the id of every proxy nested anywhere within a field value to found.
+    """
+    if isinstance(value, dict):
+        if value.get("__type") in PROXY_TYPES and "fieldId" in value:
+            found.add(value["fieldId"])
+        for item in value.values():
+            proxy_targets(item, found)
+    elif isinstance(value, list):
+        for item in value:
+            proxy_targets(item, found)
+
+
+def chunks(items, size):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class StagingLoad:
+    """
+    Loads an import into a staging collection, without secondary indexes,
+    and moves it into the live one on promote(): by renaming it over an
+    empty live collection, or otherwise by one $merge. Deletions and the
+    workspace update are held back until then.
+    """
+
+    def __init__(self, db, live: str = "documents", name: str = None, verbose: bool = True):
+        self.db = db
+        self.live = db[live]
+        self.name = name or f"{live}_staging"
+        self.collection = db[self.name]
+        self.verbose = verbose
+        self.deleted = set()
+        self.workspace_updates = []
+        self.staged = set()
+        self.timings = {}
+
+    def begin(self):
+        # whatever a failed import left behind is thrown away
+        self.db.drop_collection(self.name)
+        return self.collection
+
+    def delete(self, ids):
+        self.deleted.update(ids)
+
+    def update_one(self, filter, update):
+        self.workspace_updates.append((filter, update))
+
+    def _timed(self, stage, start):
+        self.timings[stage] = (time.perf_counter() - start) * 1000
+        if self.verbose:
+            print(f"staging {stage} took {self.timings[stage]:.1f} ms")
+
+    def build_indexes(self):
+        start = time.perf_counter()
+        for name, index in self.live.index_information().items():
+            if name == "_id_":
+                continue
+            options = {key: value for key, value in index.items() if key not in ("key", "v", "ns")}
+            self.collection.create_index(index["key"], name=name, **options)
+        self._timed("indexes", start)
+
+    def dangling(self, chunk_size: int = 1000):
+        """
+        Returns the proxy targets that neither a staged document, nor a live
+        document that survives the promotion, nor a prototype provides.
+        """
+        start = time.perf_counter()
+        targets = set()
+        self.staged = set()
+        for document in self.collection.find({}, {"fields": 1}):
+            self.staged.add(document["_id"])
+            proxy_targets(document.get("fields"), targets)
+        missing = {target for target in targets - self.staged if not PROTOTYPE_ID.match(target)}
+        surviving = missing - self.deleted
+        found = set()
+        for chunk in chunks(surviving, chunk_size):
+            found.update(document["_id"] for document in self.live.find({"_id": {"$in": chunk}}, {"_id": 1}))
+        self._timed("validation", start)
+        return sorted(missing - found)
+
+    def promote(self):
+        """
+        Validates the staged documents and moves them into the live
+        collection, then applies the held back deletions and workspace
+        updates. If any proxy dangles, nothing is changed and the staging
+        collection is kept for inspection; the dangling ids are returned.
+        """
+        dangling = self.dangling()
+        if len(dangling) > 0:
+            print(f"{len(dangling)} proxies point at missing documents, e.g. {', '.join(dangling[:10])}; "
+                  f"leaving {self.live.name} untouched and the import in {self.name}")
+            return dangling
+
+        if self.live.estimated_document_count() == 0:
+            # only a collection renamed into place keeps its own indexes
+            self.build_indexes()
+            start = time.perf_counter()
+            self.collection.rename(self.live.name, dropTarget=True)
+        else:
+            start = time.perf_counter()
+            self.collection.aggregate([{"$merge": {
+                "into": self.live.name,
+                "on": "_id",
+                "whenMatched": "replace",
+                "whenNotMatched": "insert"
+            }}])
+        self._timed("swap", start)
+
+        start = time.perf_counter()
+        # a document removed by one source file may have been staged by another
+        for chunk in chunks(self.deleted - self.staged, 1000):
+            self.live.delete_many({"_id": {"$in": chunk}})
+        for filter, update in self.workspace_updates:
+            self.live.update_one(filter, update)
+        self.db.drop_collection(self.name)
+        self._timed("cleanup", start)
+        return []
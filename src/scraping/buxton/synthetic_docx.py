@@ -0,0 +1,182 @@
+import os
+import zlib
+import struct
+import random
+import argparse
+from zipfile import ZipFile, ZIP_DEFLATED
+from xml.sax.saxutils import escape
+
+W = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+R = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+
+CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Default Extension="png" ContentType="image/png"/>
+<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+</Types>"""
+
+PACKAGE_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="%s/officeDocument" Target="word/document.xml"/>
+</Relationships>""" % R
+
+WORDS = ("chord keyboard stylus tablet mouse trackball joystick pen touch input device prototype "
+         "wireless ergonomic portable optical mechanical digitizer gesture haptic").split()
+COMPANIES = ["Acme", "Xerox", "Apple", "Microsoft", "Logitech", "Wacom", "IBM", "Sony"]
+CAPTIONS = ["Product brochure", "Video demo", "Front view", "Side view", "In use", "Packaging"]
+LOW_BITS = bytes(i & 7 for i in range(256))
+
+
+def png(width: int, height: int, rng: random.Random):
+    """
+    Builds an RGB PNG of the given size: a random two colour gradient with a
+    little noise, which decodes like a photo but compresses to a modest size.
+    """
+    start = [rng.randrange(256) for _ in range(3)]
+    end = [rng.randrange(256) for _ in range(3)]
+    noise = int.from_bytes(rng.randbytes(width * 3).translate(LOW_BITS), "big")
+    rows = []
+    for y in range(height):
+        t = y / max(1, height - 1)
+        pixel = bytes(int(a + (b - a) * t) for a, b in zip(start, end))
+        row = int.from_bytes(pixel * width, "big") ^ noise
+        rows.append(b"\x00" + row.to_bytes(width * 3, "big"))
+    return encode_png(width, height, rows)
+
+
+def flat_png(width: int, height: int, rng: random.Random, mark: bool = True):
+    """
+    Builds a PNG of flat colour, like the spacers and logos of a document:
+    a single colour, or if mark is True, a block of a second colour on it.
+    """
+    background = bytes(rng.randrange(256) for _ in range(3))
+    foreground = bytes(rng.randrange(256) for _ in range(3))
+    plain = b"\x00" + background * width
+    left, right = width // 4, width - width // 4
+    marked = b"\x00" + background * left + foreground * (right - left) + background * (width - right)
+    rows = [marked if mark and height // 4 <= y < height - height // 4 else plain for y in range(height)]
+    return encode_png(width, height, rows)
+
+
+def encode_png(width: int, height: int, rows):
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) +
+            chunk(b"IDAT", zlib.compress(b"".join(rows), 6)) + chunk(b"IEND", b""))
+
+
+def paragraph(text: str):
+    return f"<w:p><w:r><w:t xml:space=\"preserve\">{escape(text)}</w:t></w:r></w:p>"
+
+
+def table(rows):
+    cells = "".join("<w:tr>" + "".join(f"<w:tc>{paragraph(cell)}</w:tc>" for cell in row) + "</w:tr>" for row in rows)
+    return f"<w:tbl>{cells}</w:tbl>"
+
+
+def phrase(rng: random.Random, count: int):
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+
+def write_device(path: str, index: int, images: int = 3, image_size=(800, 600), icons: int = 1,
+                 shared: float = 0.0, seed: int = 0, pool=None, spacers: int = 0, logos: int = 0):
+    """
+    Writes a .docx laid out like a Buxton device document, with the given
+    number of embedded photos, near-square icons, blank spacers and flat
+    two colour logos. A fraction shared of the photos are drawn from pool,
+    a dict shared between calls, so that the same payload appears in
+    several documents.
+    """
+    rng = random.Random(seed * 1000003 + index)
+    pool = pool if pool is not None else {}
+    media = {}
+    for i in range(images):
+        if rng.random() < shared:
+            key = rng.randrange(max(1, images * 2))
+            if key not in pool:
+                pool[key] = png(*image_size, random.Random(f"{seed}/{key}"))
+            media[f"image{i + 1}.png"] = pool[key]
+        else:
+            media[f"image{i + 1}.png"] = png(*image_size, rng)
+    for i in range(icons):
+        media[f"icon{i + 1}.png"] = png(64, 64, rng)
+    for i in range(spacers):
+        media[f"spacer{i + 1}.png"] = flat_png(600, 12, rng, mark=False)
+    for i in range(logos):
+        media[f"logo{i + 1}.png"] = flat_png(320, 160, rng)
+
+    links = [rng.choice(CAPTIONS) for _ in range(2)]
+    body = [
+        "The Buxton Collection",
+        "Device",
+        f"{phrase(rng, 2).title()} {index}",
+        f"Short Description: {phrase(rng, 6)}",
+        "Long Description",
+        phrase(rng, 40),
+        phrase(rng, 25),
+        "Device Details",
+        f"Company: {rng.choice(COMPANIES)} | Year: {rng.randrange(1960, 2015)} | "
+        f"Original Price: ${rng.randrange(10, 5000)}.{rng.randrange(100):02d}",
+        f"Degrees of Freedom: {rng.randrange(1, 7)}",
+        f"Dimensions: {rng.randrange(1, 40)} x {rng.randrange(1, 40)}",
+        f"x {rng.randrange(1, 10)} cm",
+        "Key Words",
+        f"Primary: {phrase(rng, 2)}",
+        f"Secondary: {phrase(rng, 4)}",
+        "Links"
+    ] + links + ["Image"]
+    rows = [["File Name", "Caption"]] + [[name, rng.choice(CAPTIONS)] for name in media if name.startswith("image")]
+    notes = ["NOTES:", phrase(rng, 12)]
+
+    document = (f"<?xml version=\"1.0\" encoding=\"UTF-8\" standalone=\"yes\"?><w:document {W}><w:body>" +
+                "".join(map(paragraph, body)) + table(rows) + "".join(map(paragraph, notes)) +
+                "</w:body></w:document>")
+    relationships = [f'<Relationship Id="rId{i + 1}" Type="{R}/hyperlink" '
+                     f'Target="https://example.com/device/{index}/{i}" TargetMode="External"/>'
+                     for i in range(len(links))]
+    relationships += [f'<Relationship Id="rId{len(links) + i + 1}" Type="{R}/image" Target="media/{name}"/>'
+                      for i, name in enumerate(media)]
+    document_rels = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                     '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">' +
+                     "".join(relationships) + "</Relationships>")
+
+    with ZipFile(path, "w", ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", CONTENT_TYPES)
+        archive.writestr("_rels/.rels", PACKAGE_RELS)
+        archive.writestr("word/document.xml", document)
+        archive.writestr("word/_rels/document.xml.rels", document_rels)
+        for name, data in media.items():
+            # images are already compressed, as they would be in a real document
+            archive.writestr(f"word/media/{name}", data, compress_type=0)
+
+
+def generate(folder: str, count: int, **options):
+    os.makedirs(folder, exist_ok=True)
+    pool = {}
+    for index in range(count):
+        write_device(f"{folder}/device_{index:05d}.docx", index, pool=pool, **options)
+
+
+def image_size(value: str):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic Buxton device documents")
+    parser.add_argument("folder")
+    parser.add_argument("count", type=int)
+    parser.add_argument("--images", type=int, default=3, help="photos per document")
+    parser.add_argument("--image-size", type=image_size, default=(800, 600), help="photo size, e.g. 800x600")
+    parser.add_argument("--icons", type=int, default=1, help="near-square images the importers discard")
+    parser.add_argument("--spacers", type=int, default=0, help="blank images per document")
+    parser.add_argument("--logos", type=int, default=0, help="flat two colour images per document")
+    parser.add_argument("--shared", type=float, default=0.0, help="fraction of photos reused across documents")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate(args.folder, args.count, images=args.images, image_size=args.image_size,
+             icons=args.icons, shared=args.shared, seed=args.seed, spacers=args.spacers, logos=args.logos)
@@ -0,0 +1,82 @@
+import os
+from shutil import copyfile
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+# the same widths src/server/downsize.ts and DashUploadUtils resize to
+SIZES = [("_l", 900), ("_m", 400), ("_s", 100)]
+
+
+def variant_name(name: str, suffix: str):
+    return name.replace(".", suffix + ".", 1)
+
+
+def link_or_copy(source: str, target: str):
+    if os.path.exists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        copyfile(source, target)
+
+
+def make_variants(open_source, width: int, link, save):
+    """
+    Makes the _o, _l, _m and _s variants of an image width pixels wide. The
+    image is decoded at most once, from the file open_source() returns, and
+    each smaller variant is scaled down from the previous one and handed to
+    save(suffix, image, format, **options). Any variant the image is
+    already narrow enough for is made by link(suffix) instead of being
+    re-encoded.
+    """
+    link("_o")
+    if width <= SIZES[-1][1]:
+        for suffix, _ in SIZES:
+            link(suffix)
+        return
+    with open_source() as source, Image.open(source) as image:
+        format = image.format
+        current = image
+        if current.mode in ("1", "P"):
+            # palette images would otherwise be resized with nearest neighbour
+            current = current.convert("RGBA")
+        for suffix, target_width in SIZES:
+            if width <= target_width:
+                link(suffix)
+                continue
+            height = max(1, round(current.height * target_width / current.width))
+            current = current.resize((target_width, height), Image.LANCZOS)
+            if format == "JPEG":
+                if current.mode not in ("RGB", "L"):
+                    current = current.convert("RGB")
+                save(suffix, current, format, quality=80)
+            else:
+                save(suffix, current, format)
+
+
+def write_variants(source: str, target_dir: str, name: str, width: int):
+    """
+    Writes the variants of the image at source into target_dir, hard
+    linking rather than copying the ones that are the original.
+    """
+    def target(suffix):
+        return f"{target_dir}/{variant_name(name, suffix)}"
+
+    make_variants(lambda: open(source, "rb"), width,
+                  lambda suffix: link_or_copy(source, target(suffix)),
+                  lambda suffix, image, format, **options: image.save(target(suffix), format, **options))
+
+
+def write_all_variants(jobs, threads: int = 4, write=write_variants):
+    """
+    Runs write over jobs, by default write_variants over (source,
+    target_dir, name, width) tuples, with at most threads images being
+    decoded and resized at once.
+    """
+    if threads <= 1:
+        for job in jobs:
+            write(*job)
+        return
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for _ in pool.map(lambda job: write(*job), jobs):
+            pass